@@ -0,0 +1,660 @@
+"""Helpers shared by the dataset processing scripts"""
+
+import os
+import json
+import hashlib
+import pickle
+import shutil
+import subprocess
+import zipfile
+import zlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Set, Optional, Tuple, TypeVar
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+try:
+    import ijson
+except ImportError:
+    ijson = None
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    from turbojpeg import TurboJPEG, TJSAMP_420
+    _turbojpeg = TurboJPEG()
+except Exception:
+    # Missing package or libturbojpeg shared library: encode with PIL instead
+    _turbojpeg = None
+
+# Image extensions used as label.json keys (lowercase, for str.endswith)
+_IMG_EXTS = ('.jpg', '.jpeg', '.png', '.bmp')
+# Copies are IO-bound, so threads overlap well beyond the core count
+COPY_WORKERS = min(16, (os.cpu_count() or 1) * 4)
+# Pickled label filename sets and file indexes, reused while their source is unchanged
+INDEX_CACHE_DIR = './.cache'
+# Linux ioctl request for reflink copies (FICLONE)
+_FICLONE = 0x40049409
+# Archive extensions; nested archives are always extracted so their images can be filtered in turn
+_ARCHIVE_EXTS = ('.zip', '.tar.gz', '.tgz', '.tar')
+# Threads decompressing zip members in parallel; inflate saturates memory bandwidth past ~8
+ZIP_WORKERS = min(8, os.cpu_count() or 1)
+# Chunk size for inflating members and checksumming extracted ones (zlib releases the GIL)
+ZIP_CHUNK_SIZE = 1 << 20
+# Per-output-dir record of extracted parquet files, used to skip re-extraction
+DONE_MANIFEST = '.done.json'
+# Per-extract-dir record of the label filenames already pulled out of an archive
+EXTRACTED_MANIFEST = '.extracted.json'
+
+
+def enable_fast_hf_download() -> None:
+    """Opt into the faster HuggingFace download backends; call before huggingface_hub is imported"""
+    try:
+        # Multi-connection Rust downloader; huggingface_hub reads this flag at import
+        import hf_transfer  # noqa: F401
+        os.environ.setdefault('HF_HUB_ENABLE_HF_TRANSFER', '1')
+    except ImportError:
+        pass
+    # Xet-backed repos: let hf_xet use more concurrent range requests
+    os.environ.setdefault('HF_XET_HIGH_PERFORMANCE', '1')
+    os.environ.setdefault('HF_XET_NUM_CONCURRENT_RANGE_GETS', '64')
+
+
+def load_label_json(label_path: str) -> Dict:
+    """Load label.json file"""
+    try:
+        with open(label_path, 'rb') as f:
+            return json_loads(f.read())
+    except Exception as e:
+        print(f"Error: Cannot read {label_path}: {e}")
+        return {}
+
+
+def iter_label_keys(label_path: str) -> Iterator[str]:
+    """Yield top-level keys of label.json without decoding the label values"""
+    if ijson is None:
+        yield from load_label_json(label_path)
+        return
+    try:
+        with open(label_path, 'rb') as f:
+            for prefix, event, value in ijson.parse(f):
+                if prefix == '' and event == 'map_key':
+                    yield value
+    except Exception as e:
+        # Keys yielded so far are kept; report that the set is incomplete
+        print(f"Error: Cannot read {label_path}, label keys are incomplete: {e}")
+
+
+def extract_image_filenames(label_keys: Iterable[str]) -> Set[str]:
+    """Extract all image filenames from label.json (or its streamed keys)"""
+    # Keys are image filenames; only the tail can hold an extension
+    return {key for key in label_keys if key[-5:].lower().endswith(_IMG_EXTS)}
+
+
+def load_image_filenames(label_path: str) -> Set[str]:
+    """Return the image filenames of label.json, reusing a cached set while the file is unchanged"""
+    try:
+        label_stat = os.stat(label_path)
+    except OSError:
+        return set()
+    sig = (os.path.abspath(label_path), label_stat.st_mtime_ns, label_stat.st_size)
+    key = hashlib.sha1(sig[0].encode()).hexdigest()
+    cache_path = os.path.join(INDEX_CACHE_DIR, f"names_{key}.pkl")
+
+    try:
+        with open(cache_path, 'rb') as f:
+            cached_sig, image_filenames = pickle.load(f)
+        if cached_sig == sig:
+            return image_filenames
+    except Exception:
+        pass
+
+    image_filenames = extract_image_filenames(load_label_json(label_path))
+    if image_filenames:
+        try:
+            os.makedirs(INDEX_CACHE_DIR, exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                pickle.dump((sig, image_filenames), f, protocol=5)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            pass
+    return image_filenames
+
+
+def _index_pdfs(root: str) -> Tuple[Dict[str, str], Dict[str, List[str]]]:
+    """Walk root once with os.scandir, return ({name_lower: path}, {stem_lower: [paths]}) for PDFs"""
+    by_name: Dict[str, str] = {}
+    by_stem: Dict[str, List[str]] = defaultdict(list)
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                    continue
+                name_lower = entry.name.lower()
+                if name_lower.endswith('.pdf') and entry.is_file():
+                    by_name.setdefault(name_lower, entry.path)
+                    by_stem[name_lower[:-4]].append(entry.path)
+    return by_name, by_stem
+
+
+T = TypeVar('T')
+
+
+def _load_or_build_index(root: str, build: Callable[[str], T]) -> T:
+    """Return build(root), reusing a pickled copy while root's mtime is unchanged"""
+    try:
+        sig = (os.path.abspath(root), build.__name__, os.stat(root).st_mtime_ns)
+    except OSError:
+        return build(root)
+    key = hashlib.sha1(f"{sig[0]}:{sig[1]}".encode()).hexdigest()
+    cache_path = os.path.join(INDEX_CACHE_DIR, f"index_{key}.pkl")
+
+    try:
+        with open(cache_path, 'rb') as f:
+            cached_sig, index = pickle.load(f)
+        if cached_sig == sig:
+            return index
+    except Exception:
+        pass
+
+    index = build(root)
+    try:
+        os.makedirs(INDEX_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((sig, index), f, protocol=5)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+    return index
+
+
+def iter_parquet_files(root: str) -> Iterator[str]:
+    """Yield parquet file paths under root, walking with os.scandir"""
+    stack = [root]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.endswith('.parquet') and entry.is_file():
+                        yield entry.path
+        except OSError:
+            continue
+
+
+def _load_extracted(parquet_path: str, output_dir: str, num_rows: int) -> Optional[Dict[str, str]]:
+    """Return the image map recorded by a previous extraction of parquet_path, or None if stale"""
+    try:
+        with open(os.path.join(output_dir, DONE_MANIFEST), 'rb') as f:
+            entry = json_loads(f.read())[os.path.abspath(parquet_path)]
+        filenames = entry['filenames']
+        if (entry['num_rows'] != num_rows
+                or entry['source_mtime_ns'] != os.stat(parquet_path).st_mtime_ns
+                or (filenames and not os.path.exists(os.path.join(output_dir, filenames[-1])))):
+            return None
+    except Exception:
+        return None
+    output_prefix = os.path.join(output_dir, '')
+    return {filename: f"{output_prefix}{filename}" for filename in filenames}
+
+
+def _save_extracted(parquet_path: str, output_dir: str, num_rows: int, image_map: Dict[str, str]) -> None:
+    """Record the extracted filenames so reruns can skip extraction
+    Nothing is recorded unless every row was written, so the next run retries the missing ones.
+    A failed write only costs a re-extraction, so it is reported and otherwise ignored.
+    """
+    if len(image_map) != num_rows:
+        return
+    manifest_path = os.path.join(output_dir, DONE_MANIFEST)
+    try:
+        try:
+            with open(manifest_path, 'rb') as f:
+                manifest = json_loads(f.read())
+        except Exception:
+            manifest = {}
+        manifest[os.path.abspath(parquet_path)] = {
+            'num_rows': num_rows,
+            'source_mtime_ns': os.stat(parquet_path).st_mtime_ns,
+            'filenames': list(image_map),
+        }
+        tmp_path = f"{manifest_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, manifest_path)
+    except OSError as e:
+        print(f"Warning: Cannot write {manifest_path}: {e}")
+
+
+def _load_extracted_names(extract_dir: str, archive_path: str) -> Set[str]:
+    """Return the label filenames a previous run extracted from archive_path into extract_dir
+    Empty when nothing was recorded or the archive changed since; a removed archive keeps the record.
+    """
+    try:
+        with open(os.path.join(extract_dir, EXTRACTED_MANIFEST), 'rb') as f:
+            manifest = json_loads(f.read())
+        if manifest['archive'] != os.path.abspath(archive_path):
+            return set()
+        if (os.path.exists(archive_path)
+                and manifest['source_mtime_ns'] != os.stat(archive_path).st_mtime_ns):
+            return set()
+        return set(manifest['names'])
+    except Exception:
+        return set()
+
+
+def _save_extracted_names(extract_dir: str, archive_path: str, names: Set[str]) -> None:
+    """Record the label filenames extracted from archive_path; a failed write is only reported"""
+    manifest_path = os.path.join(extract_dir, EXTRACTED_MANIFEST)
+    try:
+        manifest = {
+            'archive': os.path.abspath(archive_path),
+            'source_mtime_ns': os.stat(archive_path).st_mtime_ns,
+            'names': sorted(names),
+        }
+        tmp_path = f"{manifest_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, manifest_path)
+    except OSError as e:
+        print(f"Warning: Cannot write {manifest_path}: {e}")
+
+
+def _member_filter(wanted: Optional[Set[str]]) -> Optional[Callable[[str], bool]]:
+    """Build a predicate that keeps archive members named (or stemmed) like a wanted image
+    Nested archives are always kept. Returns None when everything should be extracted.
+    Only exact names and stems are kept, so an image that find_image_file could only
+    reach through its substring fallback is not extracted and is reported as missing.
+    """
+    if wanted is None:
+        return None
+    wanted_names = {name.lower() for name in wanted}
+    wanted_stems = {Path(name).stem.lower() for name in wanted}
+    
+    def keep(member_name: str) -> bool:
+        name = member_name.rsplit('/', 1)[-1].lower()
+        return (name in wanted_names or name.endswith(_ARCHIVE_EXTS)
+                or name.rsplit('.', 1)[0] in wanted_stems)
+    
+    return keep
+
+
+def _member_path(member: zipfile.ZipInfo, extract_to: str) -> str:
+    """Target path of a zip member, sanitized the way ZipFile.extract does it (no drive, '.' or '..')"""
+    parts = [part for part in os.path.splitdrive(member.filename.replace('/', os.sep))[1].split(os.sep)
+             if part not in ('', os.curdir, os.pardir)]
+    return os.path.join(extract_to, *parts)
+
+
+def _member_is_current(member: zipfile.ZipInfo, dest_path: str) -> bool:
+    """True when dest_path already holds the member: same size and same CRC-32 as the central directory"""
+    try:
+        if os.stat(dest_path).st_size != member.file_size:
+            return False
+        crc = 0
+        with open(dest_path, 'rb') as f:
+            while chunk := f.read(ZIP_CHUNK_SIZE):
+                crc = zlib.crc32(chunk, crc)
+        return crc == member.CRC
+    except OSError:
+        return False
+
+
+def _extract_zip_members(archive_path: str, members: List[zipfile.ZipInfo], extract_to: str) -> None:
+    """Extract members with a private ZipFile handle (ZipFile objects are not thread-safe)
+    Parent directories must already exist. Members already present on disk with a
+    matching CRC-32 are left untouched.
+    """
+    with zipfile.ZipFile(archive_path, 'r') as zip_ref:
+        for member in members:
+            if member.is_dir():
+                continue
+            dest_path = _member_path(member, extract_to)
+            if _member_is_current(member, dest_path):
+                continue
+            # ZipFile.extract copies with a 16 KiB buffer; 1 MiB chunks cut the Python-level loop count
+            with zip_ref.open(member) as src, open(dest_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst, ZIP_CHUNK_SIZE)
+
+
+def _extract_zip_parallel(archive_path: str, extract_to: str,
+                          keep: Optional[Callable[[str], bool]] = None) -> None:
+    """Extract a zip archive with members split across threads; zlib releases the GIL"""
+    with zipfile.ZipFile(archive_path, 'r') as zip_ref:
+        members = zip_ref.infolist()
+    if keep is not None:
+        # Only inflate the members the labels reference
+        members = [member for member in members if keep(member.filename)]
+    if not members:
+        return
+    
+    # Create every parent directory up front so workers never race on makedirs
+    for member in members:
+        member_path = _member_path(member, extract_to)
+        if not member.is_dir():
+            member_path = os.path.dirname(member_path)
+        os.makedirs(member_path, exist_ok=True)
+    
+    # Deal members largest-first across workers to balance decompression work
+    members.sort(key=lambda member: member.file_size, reverse=True)
+    worker_count = max(1, min(ZIP_WORKERS, len(members)))
+    groups = [members[i::worker_count] for i in range(worker_count)]
+    with ThreadPoolExecutor(max_workers=worker_count) as executor:
+        for future in [executor.submit(_extract_zip_members, archive_path, group, extract_to)
+                       for group in groups]:
+            future.result()
+
+
+def _extract_tar_stream(fileobj, extract_to: str, keep: Optional[Callable[[str], bool]] = None,
+                        mode: str = 'r|') -> None:
+    """Extract a tar stream in archive order, without building a seekable member index"""
+    import tarfile
+    with tarfile.open(fileobj=fileobj, mode=mode) as tar_ref:
+        members = None
+        if keep is not None:
+            # Filter lazily; in stream mode members can only be visited once
+            members = (member for member in tar_ref if keep(member.name))
+        tar_ref.extractall(extract_to, members)
+
+
+def extract_archive(archive_path: str, extract_to: str, wanted: Optional[Set[str]] = None) -> bool:
+    """Extract archive file, limited to the wanted image filenames when given"""
+    if not os.path.exists(archive_path):
+        print(f"File does not exist: {archive_path}")
+        return False
+    
+    os.makedirs(extract_to, exist_ok=True)
+    keep = _member_filter(wanted)
+    
+    try:
+        if archive_path.endswith('.zip'):
+            _extract_zip_parallel(archive_path, extract_to, keep)
+            return True
+        elif archive_path.endswith(('.tar.gz', '.tgz')) and shutil.which('pigz'):
+            # pigz decompresses in its own process, overlapping inflate with tar parsing
+            proc = subprocess.Popen(['pigz', '-dc', archive_path], stdout=subprocess.PIPE)
+            try:
+                _extract_tar_stream(proc.stdout, extract_to, keep)
+            finally:
+                proc.stdout.close()
+                returncode = proc.wait()
+            if returncode != 0:
+                raise RuntimeError(f"pigz exited with status {returncode}")
+            return True
+        elif archive_path.endswith(('.tar.gz', '.tgz', '.tar')):
+            with open(archive_path, 'rb') as f:
+                _extract_tar_stream(f, extract_to, keep, 'r|' if archive_path.endswith('.tar') else 'r|gz')
+            return True
+        else:
+            print(f"Unsupported archive format: {archive_path}")
+            return False
+    except Exception as e:
+        print(f"Extraction failed: {e}")
+        return False
+
+
+def _write_image(image_path: str, image_bytes: bytes) -> bool:
+    """Write raw image bytes to image_path, return True on success"""
+    try:
+        # Raw fd write: no io buffer object. os.write may return after a
+        # partial write, so the remainder is written until nothing is left.
+        fd = os.open(image_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            view = memoryview(image_bytes)
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
+        return True
+    except OSError:
+        return False
+
+
+def build_image_index(search_dir: str) -> Tuple[Dict[str, str], List[Tuple[str, str]]]:
+    """Walk search_dir once with os.scandir
+    Returns: ({filename: path}, [(lowercase filename, path)]), first occurrence wins
+    """
+    by_name: Dict[str, str] = {}
+    lowered: List[Tuple[str, str]] = []
+    if not os.path.isdir(search_dir):
+        return by_name, lowered
+    stack = [search_dir]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file() and entry.name not in by_name:
+                    by_name[entry.name] = entry.path
+                    lowered.append((entry.name.lower(), entry.path))
+    return by_name, lowered
+
+
+def find_image_file(image_filename: str, by_name: Dict[str, str],
+                    lowered: List[Tuple[str, str]], *, exact_only: bool = False) -> Optional[str]:
+    """Find image file in the prebuilt index
+    With exact_only, only the exact name and its stem with another image extension match.
+    """
+    # Strategy 1: Exact filename match
+    if image_filename in by_name:
+        return by_name[image_filename]
+
+    # Strategy 2: Filename (without extension) match
+    image_stem = Path(image_filename).stem
+    for ext in _IMG_EXTS:
+        img_path = by_name.get(f"{image_stem}{ext}")
+        if img_path:
+            return img_path
+
+    if exact_only:
+        return None
+
+    # Strategy 3: Filename contains relationship (case-insensitive)
+    image_lower = image_filename.lower()
+    for name_lower, img_path in lowered:
+        if image_lower in name_lower or name_lower in image_lower:
+            return img_path
+
+    return None
+
+
+def build_image_indexes(image_map: Dict[str, str]) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """Build {stem: path} and {lowercase filename: path} indexes, first occurrence wins"""
+    stems: Dict[str, str] = {}
+    lowers: Dict[str, str] = {}
+    for stored_filename, path in image_map.items():
+        stems.setdefault(Path(stored_filename).stem, path)
+        lowers.setdefault(stored_filename.lower(), path)
+    return stems, lowers
+
+
+def find_extracted_image(image_filename: str, image_map: Dict[str, str],
+                         stems: Dict[str, str], lowers: Dict[str, str]) -> Optional[str]:
+    """Find an extracted parquet image in image_map and its build_image_indexes indexes"""
+    # Exact match
+    if image_filename in image_map:
+        return image_map[image_filename]
+
+    # Filename (without extension) match
+    path = stems.get(Path(image_filename).stem)
+    if path:
+        return path
+
+    # Case-insensitive match; extracted names are "{index}.{ext}", so no
+    # substring scan over the whole map is needed
+    return lowers.get(image_filename.lower())
+
+
+def resolve_image_files(image_filenames: Set[str], image_map: Dict[str, str]) -> Dict[str, str]:
+    """Map each label filename to its extracted image; names without one are left out"""
+    # Exact names resolve with a single set intersection; only the misses
+    # need find_extracted_image, and the map is indexed for them once
+    resolved = {image_filename: image_map[image_filename]
+                for image_filename in image_filenames & image_map.keys()}
+    misses = image_filenames - resolved.keys()
+    if misses:
+        stems, lowers = build_image_indexes(image_map)
+        for image_filename in misses:
+            # Find source image file
+            source_image_path = find_extracted_image(image_filename, image_map, stems, lowers)
+            if source_image_path:
+                resolved[image_filename] = source_image_path
+    return resolved
+
+
+def _scan_dest_stats(dest_images_dir: str) -> Dict[str, os.stat_result]:
+    """Stat every file already in dest_images_dir with a single os.scandir pass"""
+    try:
+        with os.scandir(dest_images_dir) as it:
+            return {entry.name: entry.stat() for entry in it if entry.is_file()}
+    except OSError:
+        return {}
+
+
+def _fast_copy(source_path: str, dest_path: str, source_stat: Optional[os.stat_result] = None) -> None:
+    """Copy file via reflink, then sendfile, then shutil.copyfile; only the timestamps are carried over"""
+    copied = False
+    with open(source_path, 'rb') as src, open(dest_path, 'wb') as dst:
+        in_fd, out_fd = src.fileno(), dst.fileno()
+        if source_stat is None:
+            source_stat = os.fstat(in_fd)
+        # Reflink: copy-on-write clone, no data is copied (btrfs/XFS)
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(out_fd, _FICLONE, in_fd)
+                copied = True
+            except OSError:
+                pass
+        # sendfile: in-kernel copy, bytes never pass through user space
+        if not copied and hasattr(os, 'sendfile'):
+            try:
+                while os.sendfile(out_fd, in_fd, None, 1 << 20):
+                    pass
+                copied = True
+            except OSError:
+                pass
+    if not copied:
+        shutil.copyfile(source_path, dest_path)
+    # _is_up_to_date compares mtimes; permissions and xattrs are not copied
+    os.utime(dest_path, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+
+
+def _is_up_to_date(dest_stat: os.stat_result, source_stat: os.stat_result) -> bool:
+    """True when the target needs no copy: it is the source itself (same inode, e.g. a
+    hardlink), or a copy whose size and mtime match; _fast_copy keeps the source mtime"""
+    return (os.path.samestat(dest_stat, source_stat)
+            or (dest_stat.st_size == source_stat.st_size
+                and dest_stat.st_mtime_ns == source_stat.st_mtime_ns))
+
+
+def _copy_one(task: Tuple[str, str, Optional[os.stat_result], bool]) -> int:
+    """Copy a single (source, dest, dest stat, hardlink) task, return 1 on success or 0 on failure"""
+    source_image_path, dest_image_path, dest_stat, hardlink = task
+    source_stat = None
+
+    # The target stat comes from the directory scan; the source is only stat'ed
+    # when the target exists
+    if dest_stat is not None:
+        try:
+            source_stat = os.stat(source_image_path)
+        except OSError:
+            return 0
+        if _is_up_to_date(dest_stat, source_stat):
+            return 1
+    elif hardlink:
+        # Both sides share a filesystem, so no data is written at all.
+        # Falls back to a copy if linking is unsupported.
+        try:
+            os.link(source_image_path, dest_image_path)
+            return 1
+        except OSError:
+            pass
+
+    # Copy file
+    try:
+        _fast_copy(source_image_path, dest_image_path, source_stat)
+        return 1
+    except OSError:
+        return 0
+
+
+def copy_images_for_category(category: str, image_filenames: Iterable[str],
+                              resolve: Callable[[str], Optional[str]],
+                              dest_images_dir: str, *, hardlink: bool = False) -> tuple:
+    """Copy images for a single category
+    resolve maps a label filename to its source path, or None when it is missing.
+    With hardlink=True, missing targets on the source's filesystem are hardlinked instead.
+    Returns: (success count, fail count, failed filenames)
+    """
+    os.makedirs(dest_images_dir, exist_ok=True)
+
+    success_count = 0
+    fail_count = 0
+    failed_files = []
+
+    # Stats of images already in place, from one directory scan
+    dest_stats = _scan_dest_stats(dest_images_dir)
+
+    # Hardlinks only work within one filesystem; check each source directory once
+    dest_dev = os.stat(dest_images_dir).st_dev if hardlink else None
+    same_device: Dict[str, bool] = {}
+
+    names = []
+    tasks = []
+    for image_filename in image_filenames:
+        # Find source image file
+        source_image_path = resolve(image_filename)
+
+        if not source_image_path:
+            fail_count += 1
+            failed_files.append(image_filename)
+            continue
+
+        link = False
+        if hardlink:
+            source_dir = os.path.dirname(source_image_path)
+            if source_dir not in same_device:
+                try:
+                    same_device[source_dir] = os.stat(source_dir).st_dev == dest_dev
+                except OSError:
+                    same_device[source_dir] = False
+            link = same_device[source_dir]
+
+        # Target path
+        dest_image_path = os.path.join(dest_images_dir, image_filename)
+        names.append(image_filename)
+        tasks.append((source_image_path, dest_image_path, dest_stats.get(image_filename), link))
+
+    # Copies are independent and IO-bound; run them on a thread pool
+    with ThreadPoolExecutor(max_workers=COPY_WORKERS) as executor:
+        for image_filename, copied in zip(names, executor.map(_copy_one, tasks)):
+            if copied:
+                success_count += 1
+            else:
+                fail_count += 1
+                failed_files.append(image_filename)
+
+    # Copy order is irrelevant; only the (short) failure list is sorted for output
+    failed_files.sort()
+    return success_count, fail_count, failed_files
+
+
+def _save_page(page, output_path: str) -> None:
+    """Render a PDF page at 200 dpi and save it; JPEGs are encoded with libjpeg-turbo when available"""
+    # PDF user space is 72 dpi, scale to 200 dpi like pdf2image
+    bitmap = page.render(scale=200 / 72)
+    if _turbojpeg is not None and output_path.lower().endswith(('.jpg', '.jpeg')):
+        # PDFium renders BGR, TurboJPEG's default input format; 4:2:0 matches PIL
+        jpeg_bytes = _turbojpeg.encode(bitmap.to_numpy(), quality=95, jpeg_subsample=TJSAMP_420)
+        with open(output_path, 'wb') as f:
+            f.write(jpeg_bytes)
+    else:
+        bitmap.to_pil().save(output_path, quality=95)
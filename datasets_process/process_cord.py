@@ -1,10 +1,14 @@
 #!/usr/bin/env python3
 
 import os
-import json
-import shutil
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Set, Optional
+from typing import Dict, Optional
+
+from _common import (
+    COPY_WORKERS, _write_image, copy_images_for_category, enable_fast_hf_download,
+    extract_image_filenames, iter_label_keys,
+)
 
 # Configuration
 CORD_REPO = 'naver-clova-ix/cord-v2'
@@ -26,6 +30,7 @@ def download_huggingface_dataset(repo_id: str, target_dir: str) -> Optional[str]
     
     os.makedirs(DATA_SOURCE_DIR, exist_ok=True)
     
+    enable_fast_hf_download()
     try:
         from huggingface_hub import HfApi
     except ImportError:
@@ -76,80 +81,48 @@ def download_huggingface_dataset(repo_id: str, target_dir: str) -> Optional[str]
 
 def extract_images_from_parquet(parquet_path: str, output_dir: str) -> Dict[str, str]:
     """
-    Extract images from parquet file
+    Extract images from parquet file, streaming the image column batch by batch
     Returns: Dictionary of {image filename: saved path}
     """
     os.makedirs(output_dir, exist_ok=True)
     
     try:
-        import pandas as pd
+        import pyarrow.parquet as pq
     except ImportError:
         return {}
     
     try:
-        # Read parquet file
-        df = pd.read_parquet(parquet_path)
+        parquet_file = pq.ParquetFile(parquet_path)
         
         image_map = {}
+        idx = 0
         
-        # Extract images
-        for idx, row in df.iterrows():
-            image_data = row['image']
-            
-            # Determine filename - use test_index.jpg format
-            filename = f"test_{idx}.jpg"
-            
-            # Save image
-            image_path = os.path.join(output_dir, filename)
-            
-            # Handle different types of image data
-            image_bytes = None
-            
-            if isinstance(image_data, bytes):
-                # Direct byte data
-                image_bytes = image_data
-            elif isinstance(image_data, dict):
-                # If dict, try to extract image data
-                if 'bytes' in image_data:
-                    image_bytes = image_data['bytes']
-                elif 'data' in image_data:
-                    image_bytes = image_data['data']
-                elif 'image' in image_data:
-                    image_bytes = image_data['image']
-                else:
-                    # Try to get first value
-                    if len(image_data) > 0:
-                        first_value = list(image_data.values())[0]
-                        if isinstance(first_value, bytes):
-                            image_bytes = first_value
-                        else:
-                            continue
-                    else:
-                        continue
-            elif isinstance(image_data, str):
-                # May be base64 encoded
-                if len(image_data) > 1000:
-                    try:
-                        import base64
-                        # Remove data:image/xxx;base64, prefix
-                        if ',' in image_data:
-                            image_data = image_data.split(',')[1]
-                        image_bytes = base64.b64decode(image_data)
-                    except Exception:
+        with ThreadPoolExecutor(max_workers=COPY_WORKERS) as executor:
+            # Only the image column is read; peak memory is one batch, not the whole file
+            for batch in parquet_file.iter_batches(batch_size=64, columns=['image']):
+                filenames = []
+                payloads = []
+                # CORD-v2 stores images as a {bytes, path} struct; take the bytes
+                # child directly so no per-row dict is materialized
+                column = batch.column('image')
+                if column.type.num_fields:
+                    column = column.field('bytes')
+                for image_bytes in column.to_pylist():
+                    # Determine filename - use test_index.jpg format
+                    filename = f"test_{idx}.jpg"
+                    idx += 1
+                    
+                    if not image_bytes:
                         continue
-                else:
-                    continue
-            else:
-                continue
-            
-            # Save image byte data
-            if image_bytes:
-                try:
-                    with open(image_path, 'wb') as f:
-                        f.write(image_bytes)
-                    image_map[filename] = image_path
-                except Exception:
-                    continue
+                    filenames.append(filename)
+                    payloads.append(image_bytes)
+                
+                # Save the whole batch concurrently
+                image_paths = [os.path.join(output_dir, filename) for filename in filenames]
+                written = executor.map(_write_image, image_paths, payloads)
+                for filename, image_path, ok in zip(filenames, image_paths, written):
+                    if ok:
+                        image_map[filename] = image_path
         
         return image_map
         
@@ -157,25 +130,6 @@ def extract_images_from_parquet(parquet_path: str, output_dir: str) -> Dict[str,
         return {}
 
 
-def load_label_json(label_path: str) -> Dict:
-    """Load label.json file"""
-    try:
-        with open(label_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception:
-        return {}
-
-
-def extract_image_filenames(label_data: Dict) -> Set[str]:
-    """Extract all image filenames from label.json"""
-    image_filenames = set()
-    for key in label_data.keys():
-        # Keys are image filenames
-        if any(key.lower().endswith(ext.lower()) for ext in ['.jpg', '.jpeg', '.png', '.bmp']):
-            image_filenames.add(key)
-    return image_filenames
-
-
 def find_image_file(image_filename: str, image_map: Dict[str, str]) -> Optional[str]:
     """Find image file in image map"""
     # Strategy 1: Exact filename match
@@ -197,44 +151,6 @@ def find_image_file(image_filename: str, image_map: Dict[str, str]) -> Optional[
     return None
 
 
-def copy_images_for_category(category: str, image_filenames: Set[str], 
-                              image_map: Dict[str, str], dest_images_dir: str) -> tuple:
-    """Copy images for a single category"""
-    os.makedirs(dest_images_dir, exist_ok=True)
-    
-    success_count = 0
-    fail_count = 0
-    failed_files = []
-    
-    for image_filename in sorted(image_filenames):
-        # Find source image file
-        source_image_path = find_image_file(image_filename, image_map)
-        
-        if not source_image_path:
-            fail_count += 1
-            failed_files.append(image_filename)
-            continue
-        
-        # Target path
-        dest_image_path = os.path.join(dest_images_dir, image_filename)
-        
-        # If target file exists, check if update is needed
-        if os.path.exists(dest_image_path):
-            if os.path.getsize(dest_image_path) == os.path.getsize(source_image_path):
-                success_count += 1
-                continue
-        
-        # Copy file
-        try:
-            shutil.copy2(source_image_path, dest_image_path)
-            success_count += 1
-        except Exception:
-            fail_count += 1
-            failed_files.append(image_filename)
-    
-    return success_count, fail_count, failed_files
-
-
 def process_cord():
     """Main processing workflow"""
     # 1. Download parquet file
@@ -266,17 +182,16 @@ def process_cord():
     if not os.path.exists(label_path):
         return
     
-    # Load label.json
-    label_data = load_label_json(label_path)
-    if not label_data:
+    # Extract image filenames (streams label.json keys only)
+    image_filenames = extract_image_filenames(iter_label_keys(label_path))
+    if not image_filenames:
         return
     
-    # Extract image filenames
-    image_filenames = extract_image_filenames(label_data)
-    
     # Copy images
     success, fail, failed_files = copy_images_for_category(
-        TARGET_CATEGORY, image_filenames, image_map, dest_images_dir
+        TARGET_CATEGORY, image_filenames,
+        lambda image_filename: find_image_file(image_filename, image_map),
+        dest_images_dir
     )
     
     # Output result
@@ -1,77 +1,72 @@
 #!/usr/bin/env python3
 
 import os
-import json
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
-from typing import Dict, List, Set, Optional
+from typing import Dict, List, Optional
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
 try:
     from tqdm import tqdm
 except ImportError:
     # If tqdm is not available, use simple alternative
-    def tqdm(iterable, desc=""):
+    def tqdm(iterable, desc="", total=None):
         return iterable
 
+from _common import _index_pdfs, _load_or_build_index, _save_page, extract_image_filenames, iter_label_keys
+
 # Configuration
 DEEPFORM_DIR = './datasets_process/dataset_source/DeepForm/DeepForm'
 DATA_SOURCE_DIR = './datasets_process/dataset_source'
 DATASETS_ROOT = './datasets'
+# Rasterization is CPU-bound, render one PDF per core
+RENDER_WORKERS = os.cpu_count() or 1
 
 # DeepForm corresponds to category
 TARGET_CATEGORY = 'Advertisement'
 
 
-def load_label_json(label_path: str) -> Dict:
-    """Load label.json file"""
-    try:
-        with open(label_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception:
-        return {}
-
-
-def extract_image_filenames(label_data: Dict) -> Set[str]:
-    """Extract all image filenames from label.json"""
-    image_filenames = set()
-    for key in label_data.keys():
-        # Keys are image filenames
-        if any(key.lower().endswith(ext.lower()) for ext in ['.jpg', '.jpeg', '.png', '.bmp']):
-            image_filenames.add(key)
-    return image_filenames
-
-
-def find_pdf_file(image_filename: str, search_dir: str) -> Optional[str]:
-    """Find corresponding PDF file in search directory"""
-    search_path = Path(search_dir)
-    
+def find_pdf_file(image_filename: str, pdf_by_name: Dict[str, str],
+                  pdf_by_stem: Dict[str, List[str]]) -> Optional[str]:
+    """Find corresponding PDF file in the prebuilt PDF index"""
     # Convert image filename to PDF filename (remove image extension, add .pdf)
-    image_stem = Path(image_filename).stem
-    pdf_filename = f"{image_stem}.pdf"
+    # Lowercase once; every strategy below compares case-insensitively
+    image_stem_lower = Path(image_filename).stem.lower()
     
     # Strategy 1: Exact filename match (case-insensitive)
-    for pdf_path in search_path.rglob('*.pdf'):
-        if pdf_path.is_file():
-            if pdf_path.name.lower() == pdf_filename.lower():
-                return str(pdf_path)
+    pdf_path = pdf_by_name.get(f"{image_stem_lower}.pdf")
+    if pdf_path:
+        return pdf_path
     
     # Strategy 2: Filename (without extension) match (case-insensitive)
-    image_stem_lower = image_stem.lower()
-    for pdf_path in search_path.rglob('*.pdf'):
-        if pdf_path.is_file():
-            if pdf_path.stem.lower() == image_stem_lower:
-                return str(pdf_path)
+    if image_stem_lower in pdf_by_stem:
+        return pdf_by_stem[image_stem_lower][0]
     
     # Strategy 3: Filename contains relationship (case-insensitive)
-    for pdf_path in search_path.rglob('*.pdf'):
-        if pdf_path.is_file():
-            pdf_stem = pdf_path.stem.lower()
-            if image_stem_lower in pdf_stem or pdf_stem in image_stem_lower:
-                return str(pdf_path)
+    for pdf_stem, pdf_paths in pdf_by_stem.items():
+        if image_stem_lower in pdf_stem or pdf_stem in image_stem_lower:
+            return pdf_paths[0]
     
     return None
 
 
 def pdf_to_image(pdf_path: str, output_path: str) -> bool:
     """Convert PDF file to image"""
+    # Prefer in-process PDFium rendering: no pdftoppm subprocess or PPM temp files
+    if pdfium is not None:
+        try:
+            pdf = pdfium.PdfDocument(pdf_path)
+            try:
+                _save_page(pdf[0], output_path)
+            finally:
+                pdf.close()
+            return True
+        except Exception:
+            # Fall back to pdf2image below
+            pass
+    
     try:
         from pdf2image import convert_from_path
     except ImportError:
@@ -123,13 +118,8 @@ def process_deepform():
         print(f"Error: label.json not found: {label_path}")
         return
     
-    label_data = load_label_json(label_path)
-    if not label_data:
-        print(f"Error: label.json is empty: {label_path}")
-        return
-    
-    # Extract image filenames
-    image_filenames = extract_image_filenames(label_data)
+    # Extract image filenames (streams label.json keys only)
+    image_filenames = extract_image_filenames(iter_label_keys(label_path))
     
     if not image_filenames:
         print(f"Error: No image filenames found")
@@ -142,18 +132,22 @@ def process_deepform():
     failed_count = 0
     not_found_count = 0
     
-    # Check if pdf2image is available
-    try:
-        from pdf2image import convert_from_path, convert_from_bytes
-    except ImportError:
-        print("Error: pdf2image not installed")
-        print("Please install: pip install pdf2image")
-        print("Note: Also need to install poppler-utils")
-        return
+    # Check if a PDF renderer is available (pypdfium2, or pdf2image as fallback)
+    if pdfium is None:
+        try:
+            from pdf2image import convert_from_path, convert_from_bytes
+        except ImportError:
+            print("Error: pypdfium2 and pdf2image not installed")
+            print("Please install: pip install pypdfium2")
+            print("Or: pip install pdf2image (also needs poppler-utils)")
+            return
     
-    # 3. Process each image file
-    image_filenames_sorted = sorted(image_filenames)
-    for image_filename in tqdm(image_filenames_sorted, desc="Processing PDFs"):
+    # Index DeepForm PDFs once instead of re-walking the tree per label
+    pdf_by_name, pdf_by_stem = _load_or_build_index(DEEPFORM_DIR, _index_pdfs)
+    
+    # 3. Collect PDFs that still need rendering
+    jobs = []
+    for image_filename in sorted(image_filenames):
         # Target image path (filename matches label.json)
         dest_image_path = os.path.join(images_dir, image_filename)
         
@@ -163,17 +157,23 @@ def process_deepform():
             continue
         
         # Find corresponding PDF file
-        pdf_path = find_pdf_file(image_filename, DEEPFORM_DIR)
+        pdf_path = find_pdf_file(image_filename, pdf_by_name, pdf_by_stem)
         
         if not pdf_path:
             not_found_count += 1
             continue
         
-        # Convert PDF to image
-        if pdf_to_image(pdf_path, dest_image_path):
-            success_count += 1
-        else:
-            failed_count += 1
+        jobs.append((pdf_path, dest_image_path))
+    
+    # 4. Convert PDFs to images in parallel
+    with ProcessPoolExecutor(max_workers=RENDER_WORKERS) as executor:
+        futures = [executor.submit(pdf_to_image, pdf_path, dest_image_path)
+                   for pdf_path, dest_image_path in jobs]
+        for future in tqdm(as_completed(futures), desc="Processing PDFs", total=len(futures)):
+            if future.result():
+                success_count += 1
+            else:
+                failed_count += 1
     
     # Output result
     print(f"Success: {success_count}")
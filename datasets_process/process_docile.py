@@ -2,46 +2,51 @@
 
 import os
 import json
-from pathlib import Path
-from typing import Dict, Set, Optional
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional
+try:
+    from orjson import dumps as json_dumps, loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode()
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+from _common import _IMG_EXTS, INDEX_CACHE_DIR, _index_pdfs, _load_or_build_index, _save_page, iter_label_keys
 
 # Configuration
 DOCILE_PDFS_DIR = './datasets_process/dataset_source/docile/pdfs'
 DATA_SOURCE_DIR = './datasets_process/dataset_source'
 DATASETS_ROOT = './datasets'
+# Rasterization is CPU-bound, render one PDF per core
+RENDER_WORKERS = os.cpu_count() or 1
+# One manifest per PDF folder, written once all of its pages are rendered.
+# Kept in the cache dir so nothing extra lands in the published images folders.
+DONE_MANIFEST_DIR = os.path.join(INDEX_CACHE_DIR, 'docile_done')
 
 # DOCILE corresponds to category
 TARGET_CATEGORY = 'Commercial'
 
 
-def load_label_json(label_path: str) -> Dict:
-    """Load label.json file"""
-    try:
-        with open(label_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception:
-        return {}
-
-
-def find_pdf_file(pdf_name: str, search_dir: str) -> Optional[str]:
-    """Find corresponding PDF file in search directory"""
-    search_path = Path(search_dir)
-    
-    # PDF filename (with extension)
-    pdf_filename = f"{pdf_name}.pdf"
+def find_pdf_file(pdf_name: str, pdf_by_name: Dict[str, str],
+                  pdf_by_stem: Dict[str, List[str]]) -> Optional[str]:
+    """Find corresponding PDF file in the prebuilt PDF index"""
+    # Lowercase once; both strategies compare case-insensitively
+    pdf_name_lower = pdf_name.lower()
     
     # Strategy 1: Exact filename match (case-insensitive)
-    for pdf_path in search_path.rglob('*.pdf'):
-        if pdf_path.is_file():
-            if pdf_path.name.lower() == pdf_filename.lower():
-                return str(pdf_path)
+    pdf_path = pdf_by_name.get(f"{pdf_name_lower}.pdf")
+    if pdf_path:
+        return pdf_path
     
     # Strategy 2: Filename (without extension) match (case-insensitive)
-    pdf_name_lower = pdf_name.lower()
-    for pdf_path in search_path.rglob('*.pdf'):
-        if pdf_path.is_file():
-            if pdf_path.stem.lower() == pdf_name_lower:
-                return str(pdf_path)
+    if pdf_name_lower in pdf_by_stem:
+        return pdf_by_stem[pdf_name_lower][0]
     
     return None
 
@@ -50,6 +55,23 @@ def pdf_to_images(pdf_path: str, output_dir: str) -> int:
     """Convert PDF file to images, save to output directory
     Returns number of successfully converted images
     """
+    # Prefer in-process PDFium rendering: no pdftoppm subprocess or PPM temp files
+    if pdfium is not None:
+        try:
+            pdf = pdfium.PdfDocument(pdf_path)
+            try:
+                success_count = 0
+                for idx in range(len(pdf)):
+                    output_path = os.path.join(output_dir, f"page_{idx + 1}.jpg")
+                    _save_page(pdf[idx], output_path)
+                    success_count += 1
+                return success_count
+            finally:
+                pdf.close()
+        except Exception:
+            # Fall back to pdf2image below
+            pass
+    
     try:
         from pdf2image import convert_from_path
     except ImportError:
@@ -72,7 +94,8 @@ def pdf_to_images(pdf_path: str, output_dir: str) -> int:
     try:
         # Use convert_from_path
         try:
-            images = convert_from_path(pdf_path, dpi=200)
+            # Let poppler pipeline page I/O with encoding for multi-page PDFs
+            images = convert_from_path(pdf_path, dpi=200, thread_count=2)
         except:
             # If failed, try using convert_from_bytes
             with open(pdf_path, 'rb') as f:
@@ -92,6 +115,43 @@ def pdf_to_images(pdf_path: str, output_dir: str) -> int:
         return 0
 
 
+def _manifest_path(pdf_folder: str) -> str:
+    """Path of the manifest recording pdf_folder's rendered pages"""
+    key = hashlib.sha1(os.path.abspath(pdf_folder).encode()).hexdigest()
+    return os.path.join(DONE_MANIFEST_DIR, f"{key}.json")
+
+
+def _is_converted(pdf_path: str, pdf_folder: str) -> bool:
+    """Check the folder's manifest against the source PDF's mtime and rendered page count"""
+    try:
+        with open(_manifest_path(pdf_folder), 'rb') as f:
+            manifest = json_loads(f.read())
+        page_count = manifest['page_count']
+        return (page_count > 0
+                and manifest['source_mtime_ns'] == os.stat(pdf_path).st_mtime_ns
+                and os.path.exists(os.path.join(pdf_folder, f"page_{page_count}.jpg")))
+    except Exception:
+        return False
+
+
+def convert_pdf(pdf_path: str, pdf_folder: str) -> int:
+    """Render a PDF into its folder and record a manifest when every page was written"""
+    page_count = pdf_to_images(pdf_path, pdf_folder)
+    if page_count > 0:
+        # The pages are written either way; a missing manifest only means a re-render next run
+        try:
+            manifest = {'page_count': page_count, 'source_mtime_ns': os.stat(pdf_path).st_mtime_ns}
+            manifest_path = _manifest_path(pdf_folder)
+            os.makedirs(DONE_MANIFEST_DIR, exist_ok=True)
+            tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(json_dumps(manifest))
+            os.replace(tmp_path, manifest_path)
+        except OSError as e:
+            print(f"Warning: Cannot record {pdf_path} as converted: {e}")
+    return page_count
+
+
 def process_docile():
     """Main processing workflow"""
     # 1. Check if PDFs directory exists
@@ -106,17 +166,15 @@ def process_docile():
     if not os.path.exists(label_path):
         return
     
-    label_data = load_label_json(label_path)
-    if not label_data:
-        return
-    
     # Extract PDF names (keys in label.json are PDF filenames without extension)
     # Only process PDFs that exist in label.json, not all PDFs
     # Filter out keys ending with image extensions (these are from other datasets)
     pdf_names = set(
-        key for key in label_data.keys() 
-        if not key.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp'))
+        key for key in iter_label_keys(label_path)
+        if not key[-5:].lower().endswith(_IMG_EXTS)
     )
+    if not pdf_names:
+        return
     
     # Create output directory
     os.makedirs(images_dir, exist_ok=True)
@@ -130,13 +188,14 @@ def process_docile():
     except ImportError:
         use_tqdm = False
     
-    # 3. Find corresponding PDF files based on keys in label.json and render
-    pdf_names_list = sorted(pdf_names)
-    iterator = tqdm(pdf_names_list, desc="Processing PDFs") if use_tqdm else pdf_names_list
+    # Index DOCILE PDFs once instead of re-walking the tree per label
+    pdf_by_name, pdf_by_stem = _load_or_build_index(DOCILE_PDFS_DIR, _index_pdfs)
     
-    for pdf_name in iterator:
+    # 3. Find corresponding PDF files based on keys in label.json
+    jobs = []
+    for pdf_name in sorted(pdf_names):
         # Find corresponding PDF file
-        pdf_path = find_pdf_file(pdf_name, DOCILE_PDFS_DIR)
+        pdf_path = find_pdf_file(pdf_name, pdf_by_name, pdf_by_stem)
         
         if not pdf_path:
             # If corresponding PDF not found, skip
@@ -145,20 +204,24 @@ def process_docile():
         # Create folder named after PDF name
         pdf_folder = os.path.join(images_dir, pdf_name)
         
-        # If folder exists and contains images, skip
-        if os.path.exists(pdf_folder) and os.path.isdir(pdf_folder):
-            # Check if folder contains image files
-            if any(f.endswith(('.jpg', '.jpeg', '.png')) for f in os.listdir(pdf_folder)):
-                success_count += 1
-                continue
+        # Skip only when a previous run finished every page of this PDF
+        if _is_converted(pdf_path, pdf_folder):
+            success_count += 1
+            continue
         
         # Create folder
         os.makedirs(pdf_folder, exist_ok=True)
-        
-        # Convert PDF to images
-        image_count = pdf_to_images(pdf_path, pdf_folder)
-        if image_count > 0:
-            success_count += 1
+        jobs.append((pdf_path, pdf_folder))
+    
+    # 4. Render PDFs to images in parallel
+    with ProcessPoolExecutor(max_workers=RENDER_WORKERS) as executor:
+        futures = [executor.submit(convert_pdf, pdf_path, pdf_folder)
+                   for pdf_path, pdf_folder in jobs]
+        completed = as_completed(futures)
+        iterator = tqdm(completed, desc="Processing PDFs", total=len(futures)) if use_tqdm else completed
+        for future in iterator:
+            if future.result() > 0:
+                success_count += 1
     
     # Output result
     print(f"Success: {success_count}")
@@ -1,40 +1,97 @@
 #!/usr/bin/env python3
 
 import os
-import json
-import shutil
-import zipfile
-import subprocess
-import time
-from pathlib import Path
-from typing import Dict, List, Set, Optional
+from concurrent.futures import ThreadPoolExecutor
+
+from _common import (
+    build_image_index, copy_images_for_category, extract_archive, extract_image_filenames,
+    find_image_file, load_label_json,
+)
 
 # Configuration
 FUNSD_DATASET_URL = 'https://guillaumejaume.github.io/FUNSD/dataset.zip'
 DATA_SOURCE_DIR = './datasets_process/dataset_source'
 DATASETS_ROOT = './datasets'
+# Parallel HTTP range requests per download, and bytes per read
+DOWNLOAD_SEGMENTS = 8
+DOWNLOAD_CHUNK_SIZE = 1 << 20
 
 # FUNSD corresponds to category
 TARGET_CATEGORY = 'Administrative'
 
 
+def _download_range(url: str, target_path: str, start: int, end: int) -> int:
+    """Download bytes [start, end] of url into the same offsets of target_path"""
+    import requests
+    headers = {'Range': f'bytes={start}-{end}', 'Accept-Encoding': 'identity'}
+    written = 0
+    with requests.get(url, headers=headers, stream=True, verify=False, timeout=300) as response:
+        # 200 would mean the server ignored Range and is sending the whole file
+        if response.status_code != 206:
+            raise IOError(f"Range request not honoured: HTTP {response.status_code}")
+        with open(target_path, 'r+b') as f:
+            f.seek(start)
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+                written += len(chunk)
+    return written
+
+
+def _download_segmented(url: str, target_path: str, total_size: int) -> bool:
+    """Download url as DOWNLOAD_SEGMENTS parallel range requests into a preallocated file"""
+    # The preallocated file only takes the final name once every byte has arrived
+    partial_path = f"{target_path}.part"
+    with open(partial_path, 'wb') as f:
+        f.truncate(total_size)
+    
+    segment_size = -(-total_size // DOWNLOAD_SEGMENTS)
+    ranges = [(start, min(start + segment_size, total_size) - 1)
+              for start in range(0, total_size, segment_size)]
+    try:
+        with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            futures = [executor.submit(_download_range, url, partial_path, start, end)
+                       for start, end in ranges]
+            written = sum(future.result() for future in futures)
+    except Exception:
+        return False
+    if written != total_size:
+        return False
+    os.replace(partial_path, target_path)
+    return True
+
+
 def download_file(url: str, target_path: str) -> bool:
-    """Download file"""
+    """Download file, in parallel byte ranges when the server supports them"""
     try:
         import requests
         import urllib3
         urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        
+        # Probe size and range support; a single stream is kept for small files
+        try:
+            head = requests.head(url, allow_redirects=True, verify=False, timeout=30,
+                                 headers={'Accept-Encoding': 'identity'})
+            total_size = int(head.headers.get('content-length', 0))
+            if (head.ok and head.headers.get('accept-ranges', '').lower() == 'bytes'
+                    and total_size >= DOWNLOAD_SEGMENTS * DOWNLOAD_CHUNK_SIZE):
+                if _download_segmented(head.url, target_path, total_size):
+                    return True
+        except Exception:
+            pass
+        
         response = requests.get(url, stream=True, verify=False, timeout=300)
         response.raise_for_status()
         
         total_size = int(response.headers.get('content-length', 0))
         
-        with open(target_path, 'wb') as f:
+        partial_path = f"{target_path}.part"
+        with open(partial_path, 'wb') as f:
             downloaded = 0
-            for chunk in response.iter_content(chunk_size=8192):
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
                 if chunk:
                     f.write(chunk)
                     downloaded += len(chunk)
+        os.replace(partial_path, target_path)
         
         if os.path.exists(target_path) and os.path.getsize(target_path) > 0:
             return True
@@ -46,137 +103,27 @@ def download_file(url: str, target_path: str) -> bool:
     return False
 
 
-def extract_archive(archive_path: str, extract_to: str) -> bool:
-    """Extract archive file"""
-    if not os.path.exists(archive_path):
-        return False
-    
-    os.makedirs(extract_to, exist_ok=True)
-    
-    try:
-        if archive_path.endswith('.zip'):
-            with zipfile.ZipFile(archive_path, 'r') as zip_ref:
-                zip_ref.extractall(extract_to)
-            return True
-        elif archive_path.endswith('.tar.gz') or archive_path.endswith('.tgz'):
-            import tarfile
-            with tarfile.open(archive_path, 'r:gz') as tar_ref:
-                tar_ref.extractall(extract_to)
-            return True
-        elif archive_path.endswith('.tar'):
-            import tarfile
-            with tarfile.open(archive_path, 'r') as tar_ref:
-                tar_ref.extractall(extract_to)
-            return True
-        else:
-            return False
-    except Exception as e:
-        return False
-
-
 def find_and_extract_archives(directory: str) -> bool:
     """Find and extract all archive files in directory"""
-    directory_path = Path(directory)
     archives = []
     
-    # Find all archive files
-    for ext in ['.zip', '.tar.gz', '.tgz', '.tar']:
-        archives.extend(directory_path.rglob(f'*{ext}'))
+    # Find all archive files in a single walk
+    for dirpath, _, filenames in os.walk(directory):
+        for name in filenames:
+            if name.endswith(('.zip', '.tar.gz', '.tgz', '.tar')):
+                archives.append(os.path.join(dirpath, name))
     
     if not archives:
         return True
     
     success = True
     for archive in archives:
-        if not extract_archive(str(archive), directory):
+        if not extract_archive(archive, directory):
             success = False
     
     return success
 
 
-def load_label_json(label_path: str) -> Dict:
-    """Load label.json file"""
-    try:
-        with open(label_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception as e:
-        return {}
-
-
-def extract_image_filenames(label_data: Dict) -> Set[str]:
-    """Extract all image filenames from label.json"""
-    image_filenames = set()
-    for key in label_data.keys():
-        # Keys are image filenames
-        if any(key.lower().endswith(ext.lower()) for ext in ['.jpg', '.jpeg', '.png', '.bmp']):
-            image_filenames.add(key)
-    return image_filenames
-
-
-def find_image_file(image_filename: str, search_dir: str) -> Optional[str]:
-    """Find image file in search directory"""
-    search_path = Path(search_dir)
-    
-    # Strategy 1: Exact filename match
-    for img_path in search_path.rglob(image_filename):
-        if img_path.is_file():
-            return str(img_path)
-    
-    # Strategy 2: Filename (without extension) match
-    image_stem = Path(image_filename).stem
-    for ext in ['.jpg', '.jpeg', '.png', '.bmp']:
-        for img_path in search_path.rglob(f"{image_stem}{ext}"):
-            if img_path.is_file():
-                return str(img_path)
-    
-    # Strategy 3: Filename contains relationship (case-insensitive)
-    image_lower = image_filename.lower()
-    for img_path in search_path.rglob('*'):
-        if img_path.is_file():
-            if image_lower in img_path.name.lower() or img_path.name.lower() in image_lower:
-                return str(img_path)
-    
-    return None
-
-
-def copy_images_for_category(category: str, image_filenames: Set[str], 
-                              source_dir: str, dest_images_dir: str) -> tuple:
-    """Copy images for a single category"""
-    os.makedirs(dest_images_dir, exist_ok=True)
-    
-    success_count = 0
-    fail_count = 0
-    failed_files = []
-    
-    for image_filename in sorted(image_filenames):
-        # Find source image file
-        source_image_path = find_image_file(image_filename, source_dir)
-        
-        if not source_image_path:
-            fail_count += 1
-            failed_files.append(image_filename)
-            continue
-        
-        # Target path
-        dest_image_path = os.path.join(dest_images_dir, image_filename)
-        
-        # If target file exists, check if update is needed
-        if os.path.exists(dest_image_path):
-            if os.path.getsize(dest_image_path) == os.path.getsize(source_image_path):
-                success_count += 1
-                continue
-        
-        # Copy file
-        try:
-            shutil.copy2(source_image_path, dest_image_path)
-            success_count += 1
-        except Exception as e:
-            fail_count += 1
-            failed_files.append(image_filename)
-    
-    return success_count, fail_count, failed_files
-
-
 def process_funsd():
     """Main processing workflow"""
     # 1. Download file
@@ -202,7 +149,13 @@ def process_funsd():
     # 2. Extract file
     extract_dir = os.path.join(target_dir, 'extracted')
     
-    if not (os.path.exists(extract_dir) and (any(Path(extract_dir).rglob('*.jpg')) or any(Path(extract_dir).rglob('*.png')))):
+    # Single walk that stops at the first image found
+    has_images = os.path.exists(extract_dir) and any(
+        name.endswith(('.jpg', '.png'))
+        for _, _, filenames in os.walk(extract_dir) for name in filenames
+    )
+    
+    if not has_images:
         if not extract_archive(archive_path, extract_dir):
             return
         
@@ -226,9 +179,14 @@ def process_funsd():
     # Extract image filenames
     image_filenames = extract_image_filenames(label_data)
     
+    # Walk the extracted tree once; every lookup below is a dict probe
+    by_name, lowered = build_image_index(extract_dir)
+    
     # Copy images
     success, fail, failed_files = copy_images_for_category(
-        TARGET_CATEGORY, image_filenames, extract_dir, images_dir
+        TARGET_CATEGORY, image_filenames,
+        lambda image_filename: find_image_file(image_filename, by_name, lowered),
+        images_dir
     )
     
     # Output result
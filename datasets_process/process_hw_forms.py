@@ -1,10 +1,20 @@
 #!/usr/bin/env python3
 
 import os
-import json
-import shutil
-from pathlib import Path
-from typing import Dict, List, Set, Optional
+import base64
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+try:
+    # SIMD base64 (AVX2/AVX-512/NEON), same bytes-in/bytes-out API as base64
+    from pybase64 import b64decode
+except ImportError:
+    b64decode = base64.b64decode
+
+from _common import (
+    COPY_WORKERS, DONE_MANIFEST, _load_extracted, _save_extracted, _write_image,
+    copy_images_for_category, enable_fast_hf_download, extract_image_filenames, iter_parquet_files,
+    load_label_json, resolve_image_files,
+)
 
 # Configuration
 HW_FORMS_REPO = 'ift/handwriting_forms'
@@ -12,6 +22,8 @@ DATA_SOURCE_DIR = './datasets_process/dataset_source'
 DATASETS_ROOT = './datasets'
 # Use mirror site
 USE_MIRROR = True  # Use hf-mirror.com mirror
+# Parquet rows decoded per batch; bounds memory to one batch of images
+PARQUET_BATCH_SIZE = 256
 
 # Hw-Forms corresponds to category
 TARGET_CATEGORY = 'Postal-Label'
@@ -37,6 +49,7 @@ def download_huggingface_dataset(repo_id: str, target_dir: str) -> Optional[str]
     
     os.makedirs(DATA_SOURCE_DIR, exist_ok=True)
     
+    enable_fast_hf_download()
     try:
         from huggingface_hub import HfApi
     except ImportError as e:
@@ -44,6 +57,7 @@ def download_huggingface_dataset(repo_id: str, target_dir: str) -> Optional[str]
         print("Error: huggingface_hub not installed")
         print(f"Python path: {sys.executable}")
         print("Please install: pip install huggingface_hub")
+        print("Optional, for faster downloads: pip install hf_transfer")
         print(f"Detailed error: {e}")
         return None
     
@@ -131,94 +145,118 @@ def extract_images_from_parquet(parquet_path: str, output_dir: str) -> Dict[str,
     os.makedirs(output_dir, exist_ok=True)
     
     try:
-        import pandas as pd
+        import pyarrow.parquet as pq
+        import pyarrow.types as pat
     except ImportError:
-        print("Error: pandas not installed")
-        print("Please install: pip install pandas")
+        print("Error: pyarrow not installed")
+        print("Please install: pip install pyarrow")
         return {}
     
     try:
-        # Read parquet file
-        df = pd.read_parquet(parquet_path)
-        print(f"Read {len(df)} records")
-        print(f"Column names: {list(df.columns)}")
+        parquet_file = pq.ParquetFile(parquet_path)
+        
+        # Skip extraction when a previous run already wrote this file's images;
+        # the row count comes from the parquet footer, no data is read
+        image_map = _load_extracted(parquet_path, output_dir, parquet_file.metadata.num_rows)
+        if image_map is not None:
+            print(f"Images already extracted: {len(image_map)}, skipping extraction")
+            print(f"Delete {os.path.join(output_dir, DONE_MANIFEST)} to re-extract.")
+            return image_map
+        
+        print(f"Read {parquet_file.metadata.num_rows} records")
+        print(f"Column names: {parquet_file.schema_arrow.names}")
         
         image_map = {}
         
-        # Extract images
-        for idx, row in df.iterrows():
-            image_data = row['image']
-            
-            # Determine filename - Postal-Label uses simple numeric index + .png
-            # Format in label.json is "0.png", "1.png", "2.png", etc.
-            filename = f"{idx}.png"
-            
-            # Save image
-            image_path = os.path.join(output_dir, filename)
-            
-            # Handle different types of image data
-            image_bytes = None
-            
-            if isinstance(image_data, bytes):
-                # Direct byte data
-                image_bytes = image_data
-            elif isinstance(image_data, dict):
-                # If dict, try to extract image data
-                # Possible structures: {'bytes': b'...'} or {'path': '...'} or others
-                if 'bytes' in image_data:
-                    image_bytes = image_data['bytes']
-                elif 'data' in image_data:
-                    image_bytes = image_data['data']
-                elif 'image' in image_data:
-                    image_bytes = image_data['image']
-                else:
-                    # Print dict keys for debugging
-                    print(f"Warning: Image data is dict, keys: {list(image_data.keys())}, filename: {filename}")
-                    # Try to get first value
-                    if len(image_data) > 0:
-                        first_value = list(image_data.values())[0]
-                        if isinstance(first_value, bytes):
-                            image_bytes = first_value
+        # Handle different types of image data, dispatching once on the column type
+        image_type = parquet_file.schema_arrow.field('image').type
+        struct_field = None
+        if pat.is_struct(image_type):
+            # Possible structures: {'bytes': b'...', 'path': '...'} or others
+            field_names = [image_type.field(i).name for i in range(image_type.num_fields)]
+            for struct_field in ('bytes', 'data', 'image'):
+                if struct_field in field_names:
+                    break
+            else:
+                # Print struct fields for debugging and try the first one
+                print(f"Warning: Image data is struct, fields: {field_names}")
+                struct_field = field_names[0]
+            image_type = image_type.field(struct_field).type
+        # String values may be base64 encoded
+        is_base64 = pat.is_string(image_type) or pat.is_large_string(image_type)
+        if not (is_base64 or pat.is_binary(image_type) or pat.is_large_binary(image_type)):
+            print(f"Error: Unknown image data type: {image_type}")
+            return {}
+        
+        total = parquet_file.metadata.num_rows
+        idx = 0
+        # Fixed directory prefix, so paths are built without os.path.join per row
+        output_prefix = os.path.join(output_dir, '')
+        
+        with ThreadPoolExecutor(max_workers=COPY_WORKERS) as executor:
+            # Only the image column is read; peak memory is one batch, not the whole file
+            for batch in parquet_file.iter_batches(batch_size=PARQUET_BATCH_SIZE, columns=['image']):
+                column = batch.column(0)
+                if struct_field is not None:
+                    column = column.field(struct_field)
+                
+                filenames = []
+                image_paths = []
+                payloads = []
+                
+                # One C-level conversion per batch
+                values = column.to_pylist()
+                # Determine filename - Postal-Label uses simple numeric index + .png
+                # Format in label.json is "0.png", "1.png", "2.png", etc.
+                # Names for the whole batch come from one list comprehension
+                batch_filenames = [f"{i}.png" for i in range(idx, idx + len(values))]
+                idx += len(values)
+                
+                # Extract images
+                for filename, image_data in zip(batch_filenames, values):
+                    # Save image
+                    image_path = f"{output_prefix}{filename}"
+                    
+                    if image_data is None:
+                        print(f"Warning: Image data is empty: {filename}")
+                        continue
+                    
+                    if is_base64:
+                        if len(image_data) > 1000:
+                            try:
+                                # Remove data:image/xxx;base64, prefix
+                                if ',' in image_data:
+                                    image_data = image_data.split(',')[1]
+                                image_bytes = b64decode(image_data)
+                            except Exception as e:
+                                print(f"Warning: Cannot decode base64 image {filename}: {e}")
+                                continue
                         else:
-                            print(f"Warning: Cannot extract image data from dict: {filename}")
+                            print(f"Warning: Column 'image' contains path instead of image data: {filename}")
                             continue
                     else:
-                        print(f"Warning: Dict is empty: {filename}")
-                        continue
-            elif isinstance(image_data, str):
-                # May be base64 encoded
-                if len(image_data) > 1000:
-                    try:
-                        import base64
-                        # Remove data:image/xxx;base64, prefix
-                        if ',' in image_data:
-                            image_data = image_data.split(',')[1]
-                        image_bytes = base64.b64decode(image_data)
-                    except Exception as e:
-                        print(f"Warning: Cannot decode base64 image {filename}: {e}")
+                        # Direct byte data
+                        image_bytes = image_data
+                    
+                    # Queue image byte data for saving; only written images enter image_map
+                    if not image_bytes:
+                        print(f"Warning: Image data is empty: {filename}")
                         continue
-                else:
-                    print(f"Warning: Column 'image' contains path instead of image data: {filename}")
-                    continue
-            else:
-                print(f"Warning: Unknown image data type: {type(image_data)}")
-                continue
-            
-            # Save image byte data
-            if image_bytes:
-                try:
-                    with open(image_path, 'wb') as f:
-                        f.write(image_bytes)
-                    image_map[filename] = image_path
-                except Exception as e:
-                    print(f"Warning: Failed to save image {filename}: {e}")
-                    continue
-            
-            image_map[filename] = image_path
-            
-            if (idx + 1) % 100 == 0:
-                print(f"  Processed {idx + 1}/{len(df)} samples")
+                    filenames.append(filename)
+                    image_paths.append(image_path)
+                    payloads.append(image_bytes)
+                
+                # Save the whole batch concurrently; each write is independent and IO-bound
+                written = executor.map(_write_image, image_paths, payloads)
+                for filename, image_path, ok in zip(filenames, image_paths, written):
+                    if ok:
+                        image_map[filename] = image_path
+                    else:
+                        print(f"Warning: Failed to save image {filename}")
+                
+                print(f"  Processed {idx}/{total} samples")
         
+        _save_extracted(parquet_path, output_dir, parquet_file.metadata.num_rows, image_map)
         print(f"\n✓ Extracted {len(image_map)} images")
         return image_map
         
@@ -229,85 +267,6 @@ def extract_images_from_parquet(parquet_path: str, output_dir: str) -> Dict[str,
         return {}
 
 
-def load_label_json(label_path: str) -> Dict:
-    """Load label.json file"""
-    try:
-        with open(label_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"Error: Cannot read {label_path}: {e}")
-        return {}
-
-
-def extract_image_filenames(label_data: Dict) -> Set[str]:
-    """Extract all image filenames from label.json"""
-    image_filenames = set()
-    for key in label_data.keys():
-        # Keys are image filenames
-        if any(key.lower().endswith(ext.lower()) for ext in ['.jpg', '.jpeg', '.png', '.bmp']):
-            image_filenames.add(key)
-    return image_filenames
-
-
-def find_image_file(image_filename: str, image_map: Dict[str, str]) -> Optional[str]:
-    """Find image file in image map"""
-    # Exact match
-    if image_filename in image_map:
-        return image_map[image_filename]
-    
-    # Filename (without extension) match
-    image_stem = Path(image_filename).stem
-    for stored_filename, path in image_map.items():
-        if Path(stored_filename).stem == image_stem:
-            return path
-    
-    # Filename contains relationship (case-insensitive)
-    image_lower = image_filename.lower()
-    for stored_filename, path in image_map.items():
-        if image_lower in stored_filename.lower() or stored_filename.lower() in image_lower:
-            return path
-    
-    return None
-
-
-def copy_images_for_category(category: str, image_filenames: Set[str], 
-                              image_map: Dict[str, str], dest_images_dir: str) -> tuple:
-    """Copy images for a single category"""
-    os.makedirs(dest_images_dir, exist_ok=True)
-    
-    success_count = 0
-    fail_count = 0
-    failed_files = []
-    
-    for image_filename in sorted(image_filenames):
-        # Find source image file
-        source_image_path = find_image_file(image_filename, image_map)
-        
-        if not source_image_path:
-            fail_count += 1
-            failed_files.append(image_filename)
-            continue
-        
-        # Target path
-        dest_image_path = os.path.join(dest_images_dir, image_filename)
-        
-        # If target file exists, check if update is needed
-        if os.path.exists(dest_image_path):
-            if os.path.getsize(dest_image_path) == os.path.getsize(source_image_path):
-                success_count += 1
-                continue
-        
-        # Copy file
-        try:
-            shutil.copy2(source_image_path, dest_image_path)
-            success_count += 1
-        except Exception as e:
-            fail_count += 1
-            failed_files.append(image_filename)
-    
-    return success_count, fail_count, failed_files
-
-
 def process_hw_forms():
     """Main processing workflow"""
     print("="*60)
@@ -323,19 +282,15 @@ def process_hw_forms():
     
     # 2. Extract images from parquet file
     print("\nStep 2: Extracting images from parquet file")
-    # Find downloaded parquet file
-    parquet_files = list(Path(dataset_dir).rglob('*.parquet'))
+    # Find downloaded parquet file (single scandir walk; sorted for a stable pick)
+    parquet_files = sorted(iter_parquet_files(dataset_dir))
     if not parquet_files:
         print(f"Error: Parquet file not found: {dataset_dir}")
         return
     
-    parquet_path = str(parquet_files[0])
+    parquet_path = parquet_files[0]
     print(f"Using parquet file: {parquet_path}")
     
-    if not os.path.exists(parquet_path):
-        print(f"Error: Parquet file not found: {parquet_path}")
-        return
-    
     extract_dir = os.path.join(DATA_SOURCE_DIR, 'Hw-Forms_images')
     os.makedirs(extract_dir, exist_ok=True)
     
@@ -371,7 +326,9 @@ def process_hw_forms():
     
     # Copy images
     success, fail, failed_files = copy_images_for_category(
-        TARGET_CATEGORY, image_filenames, all_image_map, images_dir
+        TARGET_CATEGORY, image_filenames,
+        resolve_image_files(image_filenames, all_image_map).get,
+        images_dir, hardlink=True
     )
     
     # Summary
@@ -1,12 +1,22 @@
 #!/usr/bin/env python3
 import os
-import json
-import shutil
+import base64
 import zipfile
 import subprocess
 import time
-from pathlib import Path
-from typing import Dict, List, Set, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+try:
+    # SIMD base64 (AVX2/AVX-512/NEON), same bytes-in/bytes-out API as base64
+    from pybase64 import b64decode
+except ImportError:
+    b64decode = base64.b64decode
+
+from _common import (
+    COPY_WORKERS, DONE_MANIFEST, _load_extracted, _save_extracted, _write_image,
+    copy_images_for_category, enable_fast_hf_download, extract_image_filenames, iter_parquet_files,
+    load_label_json, resolve_image_files,
+)
 
 # Configuration
 NANONETS_KIE_REPO = 'nanonets/key_information_extraction'
@@ -14,6 +24,10 @@ DATA_SOURCE_DIR = './datasets_process/dataset_source'
 DATASETS_ROOT = './datasets'
 # Use mirror site
 USE_MIRROR = True  # Use hf-mirror.com mirror
+# Parquet files downloaded concurrently
+DOWNLOAD_WORKERS = 8
+# Parquet rows decoded per batch; bounds memory to one batch of images
+PARQUET_BATCH_SIZE = 256
 
 # Nanonets-KIE corresponds to category
 TARGET_CATEGORY = 'Tax-Compliant'
@@ -33,57 +47,38 @@ def download_huggingface_dataset(repo_id: str, target_dir: str) -> Optional[str]
     
     os.makedirs(DATA_SOURCE_DIR, exist_ok=True)
     
+    enable_fast_hf_download()
     try:
-        from huggingface_hub import HfApi
+        from huggingface_hub import snapshot_download
     except ImportError as e:
         import sys
         print("Error: huggingface_hub not installed")
         print(f"Python path: {sys.executable}")
         print("Please install: pip install huggingface_hub")
+        print("Optional, for faster downloads: pip install hf_transfer")
         print(f"Detailed error: {e}")
         return None
     
-    # Use HfApi to list files and download one by one
-    print("\nDownloading using HfApi...")
+    # snapshot_download resolves the file list in one API call and
+    # fetches the matching parquet files concurrently
+    print("\nDownloading using snapshot_download...")
     try:
         # If using mirror, set endpoint
+        endpoint = None
         if USE_MIRROR:
-            api = HfApi(endpoint='https://hf-mirror.com')
+            endpoint = 'https://hf-mirror.com'
             print("Using mirror site: hf-mirror.com")
-        else:
-            api = HfApi()
-        files = api.list_repo_files(repo_id=repo_id, repo_type="dataset")
-        print(f"Found {len(files)} files")
-        
-        if not files:
-            print("No files found")
-            return None
-        
-        # Only download parquet files
-        parquet_files = [f for f in files if f.endswith('.parquet')]
-        if not parquet_files:
-            print("No parquet files found, downloading all files...")
-            parquet_files = files
-        
-        print(f"Will download {len(parquet_files)} files")
-        
-        for file_path in parquet_files:
-            print(f"Downloading: {file_path}")
-            try:
-                downloaded_path = api.hf_hub_download(
-                    repo_id=repo_id,
-                    filename=file_path,
-                    repo_type="dataset",
-                    local_dir=target_path,
-                    local_dir_use_symlinks=False,
-                    resume_download=True
-                )
-                print(f"  ✓ {file_path}")
-            except Exception as e:
-                print(f"  ✗ {file_path}: {e}")
+        snapshot_download(
+            repo_id=repo_id,
+            repo_type="dataset",
+            local_dir=target_path,
+            allow_patterns=["*.parquet"],
+            max_workers=DOWNLOAD_WORKERS,
+            endpoint=endpoint
+        )
         
         # Check if download succeeded
-        if os.path.exists(target_path) and any(Path(target_path).rglob('*.parquet')):
+        if any(iter_parquet_files(target_path)):
             print(f"✓ Download completed")
             return target_path
         else:
@@ -103,8 +98,7 @@ def find_parquet_files(dataset_dir: str) -> List[str]:
     """Find all parquet files"""
     print(f"\nSearching for parquet files...")
     
-    dataset_path = Path(dataset_dir)
-    parquet_files = list(dataset_path.rglob('*.parquet'))
+    parquet_files = sorted(iter_parquet_files(dataset_dir))
     
     if not parquet_files:
         print(f"No parquet files found")
@@ -114,7 +108,7 @@ def find_parquet_files(dataset_dir: str) -> List[str]:
     for pf in parquet_files:
         print(f"  - {pf}")
     
-    return [str(pf) for pf in parquet_files]
+    return parquet_files
 
 
 def extract_images_from_parquet(parquet_path: str, output_dir: str) -> Dict[str, str]:
@@ -129,36 +123,56 @@ def extract_images_from_parquet(parquet_path: str, output_dir: str) -> Dict[str,
     os.makedirs(output_dir, exist_ok=True)
     
     try:
-        import pandas as pd
+        import pyarrow.parquet as pq
+        import pyarrow.types as pat
     except ImportError:
-        print("Error: pandas not installed")
-        print("Please install: pip install pandas")
+        print("Error: pyarrow not installed")
+        print("Please install: pip install pyarrow")
         return {}
     
     try:
-        # Read parquet file
-        df = pd.read_parquet(parquet_path)
-        print(f"Read {len(df)} records")
-        print(f"Column names: {list(df.columns)}")
+        parquet_file = pq.ParquetFile(parquet_path)
+        
+        # Skip extraction when a previous run already wrote this file's images;
+        # the row count comes from the parquet footer, no data is read
+        image_map = _load_extracted(parquet_path, output_dir, parquet_file.metadata.num_rows)
+        if image_map is not None:
+            print(f"Images already extracted: {len(image_map)}, skipping extraction")
+            print(f"Delete {os.path.join(output_dir, DONE_MANIFEST)} to re-extract.")
+            return image_map
+        
+        schema = parquet_file.schema_arrow
+        print(f"Read {parquet_file.metadata.num_rows} records")
+        print(f"Column names: {schema.names}")
         
         image_map = {}
         
+        def is_text(data_type) -> bool:
+            return pat.is_string(data_type) or pat.is_large_string(data_type)
+        
+        def is_bytes(data_type) -> bool:
+            return pat.is_binary(data_type) or pat.is_large_binary(data_type)
+        
         # Find column containing images
         # Images are usually in 'image', 'image_bytes', 'image_path' and other columns
         image_column = None
         for col in ['image', 'image_bytes', 'image_path', 'image_data', 'data']:
-            if col in df.columns:
+            if col in schema.names:
                 image_column = col
                 break
         
         if not image_column:
             print("Warning: Image column not found, trying all columns...")
-            # Try all columns
-            for col in df.columns:
-                sample = df[col].iloc[0] if len(df) > 0 else None
-                if isinstance(sample, bytes) or (isinstance(sample, str) and len(sample) > 100):
-                    image_column = col
-                    print(f"Found possible image column: {col}")
+            # Try all columns, judging by the column type (and first value for strings)
+            for field in schema:
+                if is_bytes(field.type):
+                    image_column = field.name
+                elif is_text(field.type) and parquet_file.metadata.num_rows > 0:
+                    sample = next(parquet_file.iter_batches(batch_size=1, columns=[field.name])).column(0)[0].as_py()
+                    if sample and len(sample) > 100:
+                        image_column = field.name
+                if image_column:
+                    print(f"Found possible image column: {image_column}")
                     break
         
         if not image_column:
@@ -167,46 +181,83 @@ def extract_images_from_parquet(parquet_path: str, output_dir: str) -> Dict[str,
         
         print(f"Using column: {image_column}")
         
-        # Extract images
-        for idx, row in df.iterrows():
-            image_data = row[image_column]
-            
-            # Use index number as filename (match format in label.json)
-            # Filename format in label.json is "0.jpeg", "1.jpeg", etc.
-            filename = f"{idx}.jpeg"
-            
-            # Save image
-            image_path = os.path.join(output_dir, filename)
-            
-            if isinstance(image_data, bytes):
-                # Save byte data directly
-                with open(image_path, 'wb') as f:
-                    f.write(image_data)
-            elif isinstance(image_data, str):
-                # May be base64 encoded or path
-                if image_data.startswith('data:image') or len(image_data) > 1000:
-                    # May be base64
-                    try:
-                        import base64
-                        # Remove data:image/xxx;base64, prefix
-                        if ',' in image_data:
-                            image_data = image_data.split(',')[1]
-                        image_bytes = base64.b64decode(image_data)
-                        with open(image_path, 'wb') as f:
-                            f.write(image_bytes)
-                    except Exception as e:
-                        print(f"Warning: Cannot decode base64 image {filename}: {e}")
+        # Dispatch once on the image column type
+        image_type = schema.field(image_column).type
+        struct_field = None
+        if pat.is_struct(image_type) and image_type.get_field_index('bytes') >= 0:
+            # HuggingFace Image feature: {bytes, path} struct
+            struct_field = 'bytes'
+            image_type = image_type.field(struct_field).type
+        is_base64 = is_text(image_type)
+        if not (is_base64 or is_bytes(image_type)):
+            print(f"Warning: Unknown image data type: {image_type}")
+            return {}
+        
+        idx = 0
+        # Fixed directory prefix, so paths are built without os.path.join per row
+        output_prefix = os.path.join(output_dir, '')
+        
+        with ThreadPoolExecutor(max_workers=COPY_WORKERS) as executor:
+            # Only the image column is read; peak memory is one batch, not the whole file
+            for batch in parquet_file.iter_batches(batch_size=PARQUET_BATCH_SIZE, columns=[image_column]):
+                column = batch.column(0)
+                if struct_field is not None:
+                    column = column.field(struct_field)
+                
+                filenames = []
+                image_paths = []
+                payloads = []
+                
+                # One C-level conversion per batch
+                values = column.to_pylist()
+                # Use index number as filename (match format in label.json)
+                # Filename format in label.json is "0.jpeg", "1.jpeg", etc.
+                # Names for the whole batch come from one list comprehension
+                batch_filenames = [f"{i}.jpeg" for i in range(idx, idx + len(values))]
+                idx += len(values)
+                
+                # Extract images
+                for filename, image_data in zip(batch_filenames, values):
+                    # Save image
+                    image_path = f"{output_prefix}{filename}"
+                    
+                    if image_data is None:
+                        print(f"Warning: Image data is empty: {filename}")
                         continue
-                else:
-                    # May be path, skip
-                    print(f"Warning: Column {image_column} contains path instead of image data: {filename}")
-                    continue
-            else:
-                print(f"Warning: Unknown image data type: {type(image_data)}")
-                continue
-            
-            image_map[filename] = image_path
+                    
+                    if not is_base64:
+                        # Save byte data directly
+                        image_bytes = image_data
+                    else:
+                        # May be base64 encoded or path
+                        if image_data.startswith('data:image') or len(image_data) > 1000:
+                            # May be base64
+                            try:
+                                # Remove data:image/xxx;base64, prefix
+                                if ',' in image_data:
+                                    image_data = image_data.split(',')[1]
+                                image_bytes = b64decode(image_data)
+                            except Exception as e:
+                                print(f"Warning: Cannot decode base64 image {filename}: {e}")
+                                continue
+                        else:
+                            # May be path, skip
+                            print(f"Warning: Column {image_column} contains path instead of image data: {filename}")
+                            continue
+                    
+                    filenames.append(filename)
+                    image_paths.append(image_path)
+                    payloads.append(image_bytes)
+                
+                # Save the whole batch concurrently; each write is independent and IO-bound
+                written = executor.map(_write_image, image_paths, payloads)
+                for filename, image_path, ok in zip(filenames, image_paths, written):
+                    if ok:
+                        image_map[filename] = image_path
+                    else:
+                        print(f"Warning: Failed to save image {filename}")
         
+        _save_extracted(parquet_path, output_dir, parquet_file.metadata.num_rows, image_map)
         print(f"✓ Extracted {len(image_map)} images")
         return image_map
         
@@ -217,85 +268,6 @@ def extract_images_from_parquet(parquet_path: str, output_dir: str) -> Dict[str,
         return {}
 
 
-def load_label_json(label_path: str) -> Dict:
-    """Load label.json file"""
-    try:
-        with open(label_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"Error: Cannot read {label_path}: {e}")
-        return {}
-
-
-def extract_image_filenames(label_data: Dict) -> Set[str]:
-    """Extract all image filenames from label.json"""
-    image_filenames = set()
-    for key in label_data.keys():
-        # Keys are image filenames
-        if any(key.lower().endswith(ext.lower()) for ext in ['.jpg', '.jpeg', '.png', '.bmp']):
-            image_filenames.add(key)
-    return image_filenames
-
-
-def find_image_file(image_filename: str, image_map: Dict[str, str]) -> Optional[str]:
-    """Find image file in image map"""
-    # Exact match
-    if image_filename in image_map:
-        return image_map[image_filename]
-    
-    # Filename (without extension) match
-    image_stem = Path(image_filename).stem
-    for stored_filename, path in image_map.items():
-        if Path(stored_filename).stem == image_stem:
-            return path
-    
-    # Filename contains relationship (case-insensitive)
-    image_lower = image_filename.lower()
-    for stored_filename, path in image_map.items():
-        if image_lower in stored_filename.lower() or stored_filename.lower() in image_lower:
-            return path
-    
-    return None
-
-
-def copy_images_for_category(category: str, image_filenames: Set[str], 
-                              image_map: Dict[str, str], dest_images_dir: str) -> tuple:
-    """Copy images for a single category"""
-    os.makedirs(dest_images_dir, exist_ok=True)
-    
-    success_count = 0
-    fail_count = 0
-    failed_files = []
-    
-    for image_filename in sorted(image_filenames):
-        # Find source image file
-        source_image_path = find_image_file(image_filename, image_map)
-        
-        if not source_image_path:
-            fail_count += 1
-            failed_files.append(image_filename)
-            continue
-        
-        # Target path
-        dest_image_path = os.path.join(dest_images_dir, image_filename)
-        
-        # If target file exists, check if update is needed
-        if os.path.exists(dest_image_path):
-            if os.path.getsize(dest_image_path) == os.path.getsize(source_image_path):
-                success_count += 1
-                continue
-        
-        # Copy file
-        try:
-            shutil.copy2(source_image_path, dest_image_path)
-            success_count += 1
-        except Exception as e:
-            fail_count += 1
-            failed_files.append(image_filename)
-    
-    return success_count, fail_count, failed_files
-
-
 def process_nanonets_kie():
     """Main processing workflow"""
     print("="*60)
@@ -357,7 +329,9 @@ def process_nanonets_kie():
     
     # Copy images
     success, fail, failed_files = copy_images_for_category(
-        TARGET_CATEGORY, image_filenames, all_image_map, images_dir
+        TARGET_CATEGORY, image_filenames,
+        resolve_image_files(image_filenames, all_image_map).get,
+        images_dir, hardlink=True
     )
     
     # Summary
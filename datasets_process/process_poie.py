@@ -1,18 +1,23 @@
 #!/usr/bin/env python3
 
 import os
-import json
 import shutil
-import zipfile
 import subprocess
 import time
 from pathlib import Path
-from typing import Dict, List, Set, Optional
+from typing import Set, Optional
+
+from _common import (
+    _load_extracted_names, _save_extracted_names, build_image_index, copy_images_for_category,
+    extract_archive, find_image_file, load_image_filenames,
+)
 
 # Configuration
 POIE_GDRIVE_FILE_ID = '1eEMNiVeLlD-b08XW_GfAGfPmmII-GDYs'
 DATA_SOURCE_DIR = './datasets_process/dataset_source'
 DATASETS_ROOT = './datasets'
+# Streamed download chunk; large chunks keep per-chunk Python overhead negligible
+DOWNLOAD_CHUNK_SIZE = 1 << 20
 
 # POIE corresponds to category
 TARGET_CATEGORY = 'Nutrition-Label'
@@ -69,6 +74,8 @@ def download_gdrive_file(file_id: str, target_path: str) -> bool:
         
         # First request to get the confirmation token for large files
         session = requests.Session()
+        # The archive is already compressed; don't let the server gzip it again
+        session.headers['Accept-Encoding'] = 'identity'
         response = session.get(url, stream=True, verify=False, timeout=30)
         
         # Check if we got a virus scan warning (large files)
@@ -90,14 +97,17 @@ def download_gdrive_file(file_id: str, target_path: str) -> bool:
         
         with open(target_path, 'wb') as f:
             downloaded = 0
-            for chunk in response.iter_content(chunk_size=8192 * 8):  # 64KB chunks
+            last_print = time.monotonic()
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
                 if chunk:
                     f.write(chunk)
                     downloaded += len(chunk)
-                    if total_size > 0:
+                    # Print progress at most once per second
+                    now = time.monotonic()
+                    if total_size > 0 and now - last_print >= 1.0:
+                        last_print = now
                         percent = (downloaded / total_size) * 100
-                        if downloaded % (10 * 1024 * 1024) == 0:  # Print every 10MB
-                            print(f"  Downloaded: {downloaded / 1024 / 1024:.2f} MB ({percent:.1f}%)")
+                        print(f"  Downloaded: {downloaded / 1024 / 1024:.2f} MB ({percent:.1f}%)")
         
         if os.path.exists(target_path) and os.path.getsize(target_path) > 0:
             print(f"✓ Download completed: {target_path}")
@@ -117,39 +127,7 @@ def download_gdrive_file(file_id: str, target_path: str) -> bool:
     return False
 
 
-def extract_archive(archive_path: str, extract_to: str) -> bool:
-    """Extract archive file"""
-    if not os.path.exists(archive_path):
-        print(f"File does not exist: {archive_path}")
-        return False
-    
-    print(f"Extracting: {archive_path} -> {extract_to}")
-    os.makedirs(extract_to, exist_ok=True)
-    
-    try:
-        if archive_path.endswith('.zip'):
-            with zipfile.ZipFile(archive_path, 'r') as zip_ref:
-                zip_ref.extractall(extract_to)
-            return True
-        elif archive_path.endswith('.tar.gz') or archive_path.endswith('.tgz'):
-            import tarfile
-            with tarfile.open(archive_path, 'r:gz') as tar_ref:
-                tar_ref.extractall(extract_to)
-            return True
-        elif archive_path.endswith('.tar'):
-            import tarfile
-            with tarfile.open(archive_path, 'r') as tar_ref:
-                tar_ref.extractall(extract_to)
-            return True
-        else:
-            print(f"Unsupported archive format: {archive_path}")
-            return False
-    except Exception as e:
-        print(f"Extraction failed: {e}")
-        return False
-
-
-def find_and_extract_archives(directory: str) -> bool:
+def find_and_extract_archives(directory: str, wanted: Optional[Set[str]] = None) -> bool:
     """Find and extract all archive files in directory"""
     directory_path = Path(directory)
     archives = []
@@ -165,96 +143,12 @@ def find_and_extract_archives(directory: str) -> bool:
     success = True
     for archive in archives:
         print(f"Found archive file: {archive}")
-        if not extract_archive(str(archive), directory):
+        if not extract_archive(str(archive), directory, wanted):
             success = False
     
     return success
 
 
-def load_label_json(label_path: str) -> Dict:
-    """Load label.json file"""
-    try:
-        with open(label_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"Error: Cannot read {label_path}: {e}")
-        return {}
-
-
-def extract_image_filenames(label_data: Dict) -> Set[str]:
-    """Extract all image filenames from label.json"""
-    image_filenames = set()
-    for key in label_data.keys():
-        # Keys are image filenames
-        if any(key.lower().endswith(ext.lower()) for ext in ['.jpg', '.jpeg', '.png', '.bmp']):
-            image_filenames.add(key)
-    return image_filenames
-
-
-def find_image_file(image_filename: str, search_dir: str) -> Optional[str]:
-    """Find image file in search directory"""
-    search_path = Path(search_dir)
-    
-    # Strategy 1: Exact filename match
-    for img_path in search_path.rglob(image_filename):
-        if img_path.is_file():
-            return str(img_path)
-    
-    # Strategy 2: Filename (without extension) match
-    image_stem = Path(image_filename).stem
-    for ext in ['.jpg', '.jpeg', '.png', '.bmp']:
-        for img_path in search_path.rglob(f"{image_stem}{ext}"):
-            if img_path.is_file():
-                return str(img_path)
-    
-    # Strategy 3: Filename contains relationship (case-insensitive)
-    image_lower = image_filename.lower()
-    for img_path in search_path.rglob('*'):
-        if img_path.is_file():
-            if image_lower in img_path.name.lower() or img_path.name.lower() in image_lower:
-                return str(img_path)
-    
-    return None
-
-
-def copy_images_for_category(category: str, image_filenames: Set[str], 
-                              source_dir: str, dest_images_dir: str) -> tuple:
-    """Copy images for a single category"""
-    os.makedirs(dest_images_dir, exist_ok=True)
-    
-    success_count = 0
-    fail_count = 0
-    failed_files = []
-    
-    for image_filename in sorted(image_filenames):
-        # Find source image file
-        source_image_path = find_image_file(image_filename, source_dir)
-        
-        if not source_image_path:
-            fail_count += 1
-            failed_files.append(image_filename)
-            continue
-        
-        # Target path
-        dest_image_path = os.path.join(dest_images_dir, image_filename)
-        
-        # If target file exists, check if update is needed
-        if os.path.exists(dest_image_path):
-            if os.path.getsize(dest_image_path) == os.path.getsize(source_image_path):
-                success_count += 1
-                continue
-        
-        # Copy file
-        try:
-            shutil.copy2(source_image_path, dest_image_path)
-            success_count += 1
-        except Exception as e:
-            fail_count += 1
-            failed_files.append(image_filename)
-    
-    return success_count, fail_count, failed_files
-
-
 def process_poie():
     """Main processing workflow"""
     print("="*60)
@@ -284,45 +178,54 @@ def process_poie():
             print("Download failed, exiting")
             return
     
+    # Load label.json first, so extraction can skip unlabelled images
+    category_dir = os.path.join(DATASETS_ROOT, TARGET_CATEGORY)
+    label_path = os.path.join(category_dir, 'label.json')
+    images_dir = os.path.join(category_dir, 'images')
+    
+    if not os.path.exists(label_path):
+        print(f"Error: label.json not found for {TARGET_CATEGORY}: {label_path}")
+        return
+    
+    # Load image filenames from label.json (cached while label.json is unchanged)
+    image_filenames = load_image_filenames(label_path)
+    if not image_filenames:
+        print(f"Error: label.json is empty for {TARGET_CATEGORY}")
+        return
+    
+    print(f"\n{TARGET_CATEGORY}: Found {len(image_filenames)} image filenames")
+    
     # 2. Extract file
     print("\nStep 2: Extracting file")
     extract_dir = os.path.join(target_dir, 'extracted')
     
-    if os.path.exists(extract_dir) and (any(Path(extract_dir).rglob('*.jpg')) or any(Path(extract_dir).rglob('*.png'))):
-        print(f"Extraction directory already exists and contains images: {extract_dir}")
+    # Only label filenames no previous run has extracted are pulled from the archive
+    extracted = _load_extracted_names(extract_dir, archive_path)
+    missing = image_filenames - extracted
+    if not missing:
+        print(f"All labelled images already extracted: {extract_dir}")
     else:
-        if not extract_archive(archive_path, extract_dir):
+        print(f"Extracting: {archive_path} -> {extract_dir}")
+        if not extract_archive(archive_path, extract_dir, missing):
             print("Extraction failed, exiting")
             return
         
         # If there are still archive files after extraction, continue extracting
-        find_and_extract_archives(extract_dir)
+        if find_and_extract_archives(extract_dir, missing):
+            _save_extracted_names(extract_dir, archive_path, extracted | image_filenames)
     
     # 3. Process Nutrition-Label category
     print("\nStep 3: Copying images to Nutrition-Label category based on label.json")
     print("="*60)
     
-    category_dir = os.path.join(DATASETS_ROOT, TARGET_CATEGORY)
-    label_path = os.path.join(category_dir, 'label.json')
-    images_dir = os.path.join(category_dir, 'images')
-    
-    if not os.path.exists(label_path):
-        print(f"Error: label.json not found for {TARGET_CATEGORY}: {label_path}")
-        return
-    
-    # Load label.json
-    label_data = load_label_json(label_path)
-    if not label_data:
-        print(f"Error: label.json is empty for {TARGET_CATEGORY}")
-        return
-    
-    # Extract image filenames
-    image_filenames = extract_image_filenames(label_data)
-    print(f"\n{TARGET_CATEGORY}: Found {len(image_filenames)} image filenames")
+    # Index the extracted tree once instead of re-walking it for every image
+    by_name, lowered = build_image_index(extract_dir)
     
     # Copy images
     success, fail, failed_files = copy_images_for_category(
-        TARGET_CATEGORY, image_filenames, extract_dir, images_dir
+        TARGET_CATEGORY, image_filenames,
+        lambda image_filename: find_image_file(image_filename, by_name, lowered),
+        images_dir
     )
     
     # Summary
@@ -1,14 +1,15 @@
 #!/usr/bin/env python3
 import base64
 import csv
-import json
 import os
-import shutil
 import sys
 from pathlib import Path
 from typing import Dict, List, Optional, Set
 
-from huggingface_hub import hf_hub_download
+from _common import (
+    build_image_index, copy_images_for_category, enable_fast_hf_download, find_image_file,
+    load_image_filenames,
+)
 
 DATA_SOURCE_DIR = './datasets_process/dataset_source'
 DATASETS_ROOT = './datasets'
@@ -32,7 +33,9 @@ def _kie_tsv_filename() -> str:
 
 def download_kie_tsv() -> Optional[Path]:
     """Download TSV from Hugging Face (uses local cache when unchanged)."""
+    enable_fast_hf_download()
     try:
+        from huggingface_hub import hf_hub_download
         print('Fetching KIE table file (uses HF cache when already present)...')
         p = hf_hub_download(
             repo_id=_remote_dataset_id(),
@@ -101,99 +104,21 @@ def materialize_images_from_tsv(
         return False
 
 
-def load_label_json(label_path: str) -> Dict:
-    """Load label.json file"""
-    try:
-        with open(label_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception as e:
-        print(f'Error: Cannot read {label_path}: {e}')
-        return {}
-
-
-def extract_image_filenames(label_data: Dict) -> Set[str]:
-    """Extract all image filenames from label.json"""
-    image_filenames = set()
-    for key in label_data.keys():
-        if any(key.lower().endswith(ext.lower()) for ext in ['.jpg', '.jpeg', '.png', '.bmp']):
-            image_filenames.add(key)
-    return image_filenames
-
-
-def find_image_file(image_filename: str, search_dir: str) -> str:
-    """Find image file in search directory"""
-    search_path = Path(search_dir)
-
-    for img_path in search_path.rglob(image_filename):
-        if img_path.is_file():
-            return str(img_path)
-
-    image_stem = Path(image_filename).stem
-    for ext in ['.jpg', '.jpeg', '.png', '.bmp']:
-        for img_path in search_path.rglob(f"{image_stem}{ext}"):
-            if img_path.is_file():
-                return str(img_path)
-
-    image_lower = image_filename.lower()
-    for img_path in search_path.rglob('*'):
-        if img_path.is_file():
-            if image_lower in img_path.name.lower() or img_path.name.lower() in image_lower:
-                return str(img_path)
-
-    return None
-
-
-def copy_images_for_category(
-    category: str,
-    image_filenames: Set[str],
-    source_dir: str,
-    dest_images_dir: str,
-) -> tuple:
-    """Copy images for a single category"""
-    os.makedirs(dest_images_dir, exist_ok=True)
-
-    success_count = 0
-    fail_count = 0
-    failed_files = []
-
-    for image_filename in sorted(image_filenames):
-        source_image_path = find_image_file(image_filename, source_dir)
-
-        if not source_image_path:
-            fail_count += 1
-            failed_files.append(image_filename)
-            continue
-
-        dest_image_path = os.path.join(dest_images_dir, image_filename)
-
-        if os.path.exists(dest_image_path):
-            if os.path.getsize(dest_image_path) == os.path.getsize(source_image_path):
-                success_count += 1
-                continue
-
-        try:
-            shutil.copy2(source_image_path, dest_image_path)
-            success_count += 1
-        except Exception:
-            fail_count += 1
-            failed_files.append(image_filename)
-
-    return success_count, fail_count, failed_files
-
-
 def process_sibr():
     """Main processing workflow"""
     print('=' * 60)
     print('SIBR Dataset Processing Script')
     print('=' * 60)
 
+    # Image filenames per category, read once (and cached while label.json is unchanged)
+    category_filenames: Dict[str, Set[str]] = {}
     needed: Set[str] = set()
     for category in SIBR_CATEGORIES:
         label_path = os.path.join(DATASETS_ROOT, category, 'label.json')
         if not os.path.exists(label_path):
             continue
-        label_data = load_label_json(label_path)
-        needed |= extract_image_filenames(label_data)
+        category_filenames[category] = load_image_filenames(label_path)
+        needed |= category_filenames[category]
 
     if not needed:
         print('No image keys found in label.json files; nothing to do.')
@@ -214,6 +139,9 @@ def process_sibr():
     print('\nStep 3: Copy images to category folders (split unchanged)')
     print('=' * 60)
 
+    # Index the decoded cache once and share it across all categories
+    by_name, lowered = build_image_index(extract_dir)
+
     total_success = 0
     total_fail = 0
     all_failed_files: Dict[str, List[str]] = {}
@@ -227,16 +155,17 @@ def process_sibr():
             print(f'\nWarning: {category} label.json not found: {label_path}')
             continue
 
-        label_data = load_label_json(label_path)
-        if not label_data:
+        image_filenames = category_filenames.get(category)
+        if not image_filenames:
             print(f'\nWarning: {category} label.json is empty')
             continue
 
-        image_filenames = extract_image_filenames(label_data)
         print(f'\n{category}: {len(image_filenames)} image filenames in labels')
 
         success, fail, failed_files = copy_images_for_category(
-            category, image_filenames, extract_dir, images_dir
+            category, image_filenames,
+            lambda image_filename: find_image_file(image_filename, by_name, lowered),
+            images_dir,
         )
 
         total_success += success
@@ -1,14 +1,36 @@
 
+import re
 import json
 import argparse
+import functools
 from pathlib import Path
 from collections import defaultdict
+try:
+    from orjson import loads as orjson_loads
+except ImportError:
+    orjson_loads = None
 
 import kie_evaluator
 
 DATASETS_DIR = Path(__file__).parent.parent / "datasets"
 
+# Digit runs long enough to overflow 64 bits, which orjson would silently turn into floats
+_WIDE_INT = re.compile(rb'\d{19,}')
 
+
+def json_loads(line: bytes):
+    """Parse one JSONL line with orjson, or with json where orjson would differ from it"""
+    # json keeps wide integers exact and accepts NaN/Infinity, which orjson rejects
+    if orjson_loads is None or _WIDE_INT.search(line):
+        return json.loads(line)
+    try:
+        return orjson_loads(line)
+    except json.JSONDecodeError:
+        return json.loads(line)
+
+
+# Field values (dates, labels, codes) repeat heavily across samples; normalize each distinct one once
+@functools.lru_cache(maxsize=100_000)
 def normalize_func(text, **kwargs):
     """Text normalization function"""
     halfwidth_text = kie_evaluator.fullwidth_to_halfwidth(str(text))
@@ -27,13 +49,14 @@ def load_predictions(pred_jsonl_path: str) -> dict:
     
     print(f"Loading predictions: {pred_jsonl_path}")
     
-    with open(pred_jsonl_path, 'r', encoding='utf-8') as f:
+    # Lines stay bytes; both parsers accept them and ignore the trailing newline
+    with open(pred_jsonl_path, 'rb') as f:
         for line_num, line in enumerate(f, 1):
-            if not line.strip():
+            if line.isspace():
                 continue
             
             try:
-                data = json.loads(line.strip())
+                data = json_loads(line)
                 
                 # Get dataset name and URL
                 dataset = data.get("dataset", "unknown")
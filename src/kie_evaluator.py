@@ -1,5 +1,6 @@
 import json
 import re
+import sys
 from typing import Any, Dict, List, Tuple, Union
 
 from collections import Counter
@@ -26,20 +27,28 @@ def flatten(data: dict):
     """
     flatten_data = list()
 
-    def _flatten(value, key=""):
-        if type(value) is dict:
-            for child_key, child_value in value.items():
-                _flatten(child_value, f"{key}.{child_key}" if key else child_key)
-        elif type(value) is list:
-            for value_item in value:
-                _flatten(value_item, key)
+    # Explicit stack instead of recursion; children are pushed reversed so they pop in order.
+    # Key paths are interned: the few distinct paths recur in every sample and key metric_info.
+    stack = [(data, "")]
+    while stack:
+        value, key = stack.pop()
+        value_type = type(value)
+        if value_type is dict:
+            for child_key, child_value in reversed(value.items()):
+                stack.append((child_value, sys.intern(f"{key}.{child_key}" if key else child_key)))
+        elif value_type is list:
+            for value_item in reversed(value):
+                stack.append((value_item, key))
         else:
             flatten_data.append((key, value))
 
-    _flatten(data)
     return flatten_data
 
 
+# Exact scalar types kept from mixed lists (type() match, so bool is excluded as before)
+_SCALAR_TYPES = frozenset((str, int, float))
+
+
 def normalize_dict(data: Union[Dict, List, Any]):
     """
     Sort by value, while iterate over element if data is list
@@ -47,7 +56,8 @@ def normalize_dict(data: Union[Dict, List, Any]):
     # if not data:
     #     return {}
 
-    if isinstance(data, dict):
+    data_type = type(data)
+    if data_type is dict:
         new_data = dict()
         for key in sorted(data.keys(), key=lambda k: (len(k), k)):
             value = normalize_dict(data[key])
@@ -56,7 +66,7 @@ def normalize_dict(data: Union[Dict, List, Any]):
                     value = [value]
                 new_data[key] = value
 
-    elif isinstance(data, list):
+    elif data_type is list:
         if all(isinstance(item, dict) for item in data):
             new_data = []
             for item in data:
@@ -64,7 +74,7 @@ def normalize_dict(data: Union[Dict, List, Any]):
                 if item:
                     new_data.append(item)
         else:
-            new_data = [str(item).strip() for item in data if type(item) in {str, int, float} and str(item).strip()]
+            new_data = [str(item).strip() for item in data if type(item) in _SCALAR_TYPES and str(item).strip()]
     else:
         new_data = [str(data).strip()]
     return new_data
@@ -80,20 +90,35 @@ def cal_f1_all(preds, answers):
     for file_name, answer in answers.items():
         sample_error_info = {"fp": [], "fn": [], "tp": []}
         pred = preds.get(file_name, {})
-        pred, answer = flatten(normalize_dict(pred)), flatten(normalize_dict(answer))
-        for field in pred:
-            field_name = field[0]
-            if field_name not in metric_info:
-                metric_info[field_name] = {"total_tp": 0, "total_fn_or_fp": 0}
-            if field in answer:
-                total_tp += 1
-                metric_info[field_name]["total_tp"] += 1
-                sample_error_info["tp"].append(field)
-                answer.remove(field)
-            else:
-                total_fn_or_fp += 1
-                metric_info[field_name]["total_fn_or_fp"] += 1
-                sample_error_info["fp"].append(field)
+        # A missing prediction flattens to no fields; every answer field is then counted as FN below
+        pred = flatten(normalize_dict(pred)) if pred != {} else []
+        answer = flatten(normalize_dict(answer))
+        if pred:
+            # Answer fields as a multiset, so matching a pred field is O(1) instead of a list scan
+            answer_counter, matched_counter = Counter(answer), Counter()
+            for field in pred:
+                field_name = field[0]
+                if field_name not in metric_info:
+                    metric_info[field_name] = {"total_tp": 0, "total_fn_or_fp": 0}
+                if answer_counter[field] > 0:
+                    total_tp += 1
+                    metric_info[field_name]["total_tp"] += 1
+                    sample_error_info["tp"].append(field)
+                    answer_counter[field] -= 1
+                    matched_counter[field] += 1
+                else:
+                    total_fn_or_fp += 1
+                    metric_info[field_name]["total_fn_or_fp"] += 1
+                    sample_error_info["fp"].append(field)
+
+            # Unmatched answer fields in their original order; matches consume the first occurrences
+            unmatched = []
+            for field in answer:
+                if matched_counter[field] > 0:
+                    matched_counter[field] -= 1
+                else:
+                    unmatched.append(field)
+            answer = unmatched
 
         total_fn_or_fp += len(answer)
         for field in answer:
@@ -169,40 +194,41 @@ def post_process_to_json(qwen_info_str, file_name=None):
         return None
 
 
+# Full-width -> half-width mapping for str.translate, with the follow-up
+# replacements folded in ("、" -> ",", "-" and "–" dropped, "’" -> "'")
+_FW2HW_TABLE = {cp: cp - 0xFEE0 for cp in range(0xFF01, 0xFF5F)}
+_FW2HW_TABLE.update({
+    0x3000: 0x0020,
+    0xFFE5: 0x00A5,
+    0x2103: chr(0x00B0) + 'C',
+    0x3001: ",",
+    0x2019: "'",
+    0x2014: None,  # maps to "-", which is then removed
+    0xFF0D: None,  # full-width "-"
+    0x002D: None,
+    0x2013: None,
+})
+
+
 def fullwidth_to_halfwidth(text):
-    result = ''
-    for char in text:
-        code_point = ord(char)
-        if code_point == 0x3000:
-            code_point = 0x0020
-        elif code_point == 0xFFE5:
-            code_point = 0x00A5
-        elif code_point == 0x2014:
-            code_point = 0x002D
-        elif code_point == 0x2103:
-            result += chr(0x00B0) + 'C'
-            continue
-        elif 0xFF01 <= code_point <= 0xFF5E:
-            code_point -= 0xFEE0
-        result += chr(code_point)
-    result = result.replace("、", ",")
-    result = result.replace("-", "")
-    result = result.replace("–","")
-    result = result.replace("’","'")
-    result = result.rstrip("。.")
-    return result
+    return text.translate(_FW2HW_TABLE).rstrip("。.")
+
+
+_JSON_FENCE_RE = re.compile(r'```json\s*(.*?)\s*```', re.DOTALL)
+_CODE_FENCE_RE = re.compile(r'```\s*(.*?)\s*```', re.DOTALL)
 
 
 def remove_unnecessary_spaces(text):
     if "```json" in text:
-        json_match = re.search(r'```json\s*(.*?)\s*```', text, re.DOTALL)
+        json_match = _JSON_FENCE_RE.search(text)
         if json_match:
             text = json_match.group(1).strip()
     elif "```" in text:
-        code_match = re.search(r'```\s*(.*?)\s*```', text, re.DOTALL)
+        code_match = _CODE_FENCE_RE.search(text)
         if code_match:
             text = code_match.group(1).strip()
-    text = re.sub(r'\s+', '', text)
+    # str.split() breaks on exactly the characters \s matches, so this equals re.sub(r'\s+', '', text)
+    text = ''.join(text.split())
     return text
 
 
@@ -3,13 +3,23 @@ import re
 import json
 import asyncio
 import base64
+import functools
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 import tqdm
 import aiofiles
 from openai import AsyncOpenAI
 from io import BytesIO
 from PIL import Image
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson-backed loader that falls back to json for wide integers and NaN/Infinity
+from evaluate_results import json_loads
 
 # ================== Configuration ==================
 IMG_EXTS      = {".png", ".jpg", ".jpeg", ".webp", ".bmp"}
@@ -17,6 +27,8 @@ DATASETS_DIR  = Path(__file__).parent.parent / "datasets"
 MODEL_NAME    = ""
 MAX_CONC      = 16
 MAX_RETRIES   = 10
+FLUSH_EVERY   = 64  # results per output flush; closing the file flushes the rest
+KEEP_RAW_RESPONSE = False  # raw_response duplicates model_result; evaluation never reads it
 OPENAI_KEY    = ""  
 API_BASE      = ""
 
@@ -27,10 +39,24 @@ Suppose you are an information extraction expert. Now given a json schema, fill
 """
 
 client: Optional[AsyncOpenAI] = None
+# Decode/resize/JPEG-encode is CPU-bound and holds the GIL; it runs in worker processes
+img_pool: Optional[ProcessPoolExecutor] = None
 
 def natural_key(s: str):
     return [int(t) if t.isdigit() else t.lower() for t in re.split(r"(\d+)", s)]
 
+def dumps_jsonl(obj) -> bytes:
+    """Serialize one result as a UTF-8 JSONL line"""
+    if orjson is not None:
+        try:
+            line = orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+            # orjson writes NaN/Infinity as null; json keeps them, so any null is re-encoded there
+            if b"null" not in line:
+                return line
+        except orjson.JSONEncodeError:
+            pass  # e.g. integers beyond 64 bits parsed from model output
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
 def get_output_filename(dataset_name: str, model_name: Optional[str] = None) -> str:
     if model_name is None:
         model_name = MODEL_NAME
@@ -38,9 +64,12 @@ def get_output_filename(dataset_name: str, model_name: Optional[str] = None) ->
     return str(Path("results") / dataset_name / f"result_{clean}.jsonl")
 
 def list_images_under(folder: Path) -> List[Path]:
-    if not folder.exists() or not folder.is_dir():
+    if not folder.is_dir():
         return []
-    imgs = [p for p in folder.iterdir() if p.is_file() and p.suffix.lower() in IMG_EXTS]
+    # scandir's cached d_type answers is_file() without a stat per entry
+    with os.scandir(folder) as it:
+        imgs = [Path(e.path) for e in it
+                if os.path.splitext(e.name)[1].lower() in IMG_EXTS and e.is_file()]
     imgs.sort(key=lambda p: natural_key(p.name))
     return imgs
 
@@ -56,11 +85,25 @@ def encode_image_to_base64_jpeg_with_max_pixels(image_path: Path) -> str:
             im = im.resize((new_w, new_h), Image.LANCZOS)
 
         buf = BytesIO()
-        # Balance quality and size; can lower quality to 90/85 for smaller size
-        im.save(buf, format="JPEG", quality=95, optimize=True)
+        # Balance quality and size; can lower quality to 90/85 for smaller size.
+        # No optimize=True: the extra Huffman pass costs encode CPU for a few percent of size.
+        im.save(buf, format="JPEG", quality=95)
         data = buf.getvalue()
     return base64.b64encode(data).decode("utf-8")
 
+@functools.lru_cache(maxsize=None)
+def images_by_stem(images_dir: Path) -> Dict[str, List[Path]]:
+    """Index a dataset's images dir once per run: {stem: images in natural order}"""
+    index = defaultdict(list)
+    with os.scandir(images_dir) as it:
+        for e in it:
+            stem, ext = os.path.splitext(e.name)
+            if ext.lower() in IMG_EXTS and e.is_file():
+                index[stem].append(Path(e.path))
+    for candidates in index.values():
+        candidates.sort(key=lambda p: natural_key(p.name))
+    return dict(index)
+
 def resolve_images_for_url(dataset_dir: Path, url: str) -> List[Path]:
     p = dataset_dir / url
     if p.exists():
@@ -85,19 +128,19 @@ def resolve_images_for_url(dataset_dir: Path, url: str) -> List[Path]:
         cand = images_dir / url
         if cand.exists() and cand.is_file() and cand.suffix.lower() in IMG_EXTS:
             return [cand]
-        stem = Path(url).stem
-        candidates = [x for x in images_dir.iterdir()
-                      if x.is_file() and x.stem == stem and x.suffix.lower() in IMG_EXTS]
-        candidates.sort(key=lambda p: natural_key(p.name))
+        candidates = images_by_stem(images_dir).get(Path(url).stem)
         if candidates:
-            return candidates
+            return list(candidates)
 
     raise FileNotFoundError(f"Cannot resolve image/folder for url: {url}")
 
-def build_messages(images: List[Path], schema_text: str) -> list:
+async def build_messages(images: List[Path], schema_text: str) -> list:
+    loop = asyncio.get_running_loop()
+    encoded = await asyncio.gather(*(
+        loop.run_in_executor(img_pool, encode_image_to_base64_jpeg_with_max_pixels, img) for img in images
+    ))
     content = []
-    for img in images:
-        b64 = encode_image_to_base64_jpeg_with_max_pixels(img)
+    for b64 in encoded:
         content.append({
             "type": "image_url",
             "image_url": {"url": f"data:image/jpeg;base64,{b64}"}
@@ -138,60 +181,60 @@ def post_process_to_json(openai_info_str: str) -> Tuple[Optional[dict], Optional
     except Exception as e:
         return None, str(e)
 
-async def process_one(sample: dict, sem: asyncio.Semaphore, model_name: str, max_images: Optional[int]) -> dict:
-    async with sem:
-        dataset = sample["dataset"]
-        url = sample["url"]
-        schema = sample["prompt"]
-        dataset_dir = DATASETS_DIR / dataset
+async def process_one(sample: dict, model_name: str, max_images: Optional[int]) -> dict:
+    dataset = sample["dataset"]
+    url = sample["url"]
+    schema = sample["prompt"]
+    dataset_dir = DATASETS_DIR / dataset
 
-        try:
-            images = resolve_images_for_url(dataset_dir, url)
-            if max_images and max_images > 0:
-                images = images[:max_images]
-            messages = build_messages(images, schema)
-
-            raw_text = None
-            attempts = 0
-            last_err = None
-            for attempt in range(MAX_RETRIES):
-                try:
-                    raw_text = await call_api_once(messages, model_name)
-                    attempts = attempt + 1
-                    break
-                except Exception as e:
-                    last_err = str(e)
-                    attempts = attempt + 1
-                    if attempt < MAX_RETRIES - 1:
-                        print(f"[RETRY] {dataset}/{url} attempt {attempt+1} failed: {e}")
-                    else:
-                        print(f"[FAILED] {dataset}/{url} all {MAX_RETRIES} attempts failed: {e}")
-
-            if raw_text is None:
-                return {"dataset": dataset, "url": url, "error": f"API failed: {last_err}", "retry_attempts": attempts}
-
-            parsed, perr = post_process_to_json(raw_text)
-            if parsed is not None:
-                return {
-                    "dataset": dataset,
-                    "url": url,
-                    "model_result": parsed,
-                    "raw_response": raw_text,
-                    "retry_attempts": attempts,
-                    "images": [str(p) for p in images],  # For traceability
-                }
-            else:
-                return {
-                    "dataset": dataset,
-                    "url": url,
-                    "model_result": {"_raw_text": raw_text, "_parse_error": perr},
-                    "raw_response": raw_text,
-                    "retry_attempts": attempts,
-                    "images": [str(p) for p in images],
-                }
-
-        except Exception as e:
-            return {"dataset": dataset, "url": url, "error": str(e), "retry_attempts": 0}
+    try:
+        images = resolve_images_for_url(dataset_dir, url)
+        if max_images and max_images > 0:
+            images = images[:max_images]
+        messages = await build_messages(images, schema)
+
+        raw_text = None
+        attempts = 0
+        last_err = None
+        for attempt in range(MAX_RETRIES):
+            try:
+                raw_text = await call_api_once(messages, model_name)
+                attempts = attempt + 1
+                break
+            except Exception as e:
+                last_err = str(e)
+                attempts = attempt + 1
+                if attempt < MAX_RETRIES - 1:
+                    print(f"[RETRY] {dataset}/{url} attempt {attempt+1} failed: {e}")
+                else:
+                    print(f"[FAILED] {dataset}/{url} all {MAX_RETRIES} attempts failed: {e}")
+
+        if raw_text is None:
+            return {"dataset": dataset, "url": url, "error": f"API failed: {last_err}", "retry_attempts": attempts}
+
+        parsed, perr = post_process_to_json(raw_text)
+        if parsed is not None:
+            result = {
+                "dataset": dataset,
+                "url": url,
+                "model_result": parsed,
+                "retry_attempts": attempts,
+                "images": [str(p) for p in images],  # For traceability
+            }
+        else:
+            result = {
+                "dataset": dataset,
+                "url": url,
+                "model_result": {"_raw_text": raw_text, "_parse_error": perr},
+                "retry_attempts": attempts,
+                "images": [str(p) for p in images],
+            }
+        if KEEP_RAW_RESPONSE:
+            result["raw_response"] = raw_text
+        return result
+
+    except Exception as e:
+        return {"dataset": dataset, "url": url, "error": str(e), "retry_attempts": 0}
 
 def load_qa_jsonl(dataset_name: str, jsonl_path: Optional[str] = None, limit: Optional[int] = None) -> List[dict]:
     if jsonl_path is None:
@@ -202,12 +245,11 @@ def load_qa_jsonl(dataset_name: str, jsonl_path: Optional[str] = None, limit: Op
         raise FileNotFoundError(f"Dataset file does not exist: {jsonl_path}")
 
     rows = []
-    with open(jsonl_path, "r", encoding="utf-8") as f:
+    with open(jsonl_path, "rb") as f:
         for line in f:
-            line = line.strip()
-            if not line:
+            if line.isspace():
                 continue
-            obj = json.loads(line)
+            obj = json_loads(line)
             if "dataset" not in obj:
                 obj["dataset"] = dataset_name
             for k in ("url", "prompt"):
@@ -219,31 +261,53 @@ def load_qa_jsonl(dataset_name: str, jsonl_path: Optional[str] = None, limit: Op
     return rows
 
 async def main_async(samples: List[dict], output_file: str, model_name: str, concurrency: int, api_key: str, api_base: str, max_images: Optional[int]):
-    global client
+    global client, img_pool
     client = AsyncOpenAI(api_key=api_key, base_url=api_base)
+    img_pool = ProcessPoolExecutor(max_workers=os.cpu_count())
 
     Path(output_file).parent.mkdir(parents=True, exist_ok=True)
-    sem = asyncio.Semaphore(concurrency)
-    tasks = [asyncio.create_task(process_one(s, sem, model_name, max_images)) for s in samples]
+    # A fixed set of workers pulls samples from a shared iterator, so only `concurrency`
+    # requests (not one task per sample) are in flight; the bounded queue hands results to the writer
+    results: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    pending = iter(samples)
+
+    async def worker():
+        for s in pending:
+            try:
+                res = await process_one(s, model_name, max_images)
+            except Exception as e:
+                # The writer expects one result per sample, so a failure must still produce a row
+                res = {"dataset": s.get("dataset"), "url": s.get("url"), "error": str(e), "retry_attempts": 0}
+            await results.put(res)
+
+    workers = [asyncio.create_task(worker()) for _ in range(max(1, concurrency))]
 
     ok = 0
     fail = 0
-    async with aiofiles.open(output_file, "w", encoding="utf-8") as fh:
-        for coro in tqdm.tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Processing progress"):
-            res = await coro
-            await fh.write(json.dumps(res, ensure_ascii=False) + "\n")
-            await fh.flush()
-            if res.get("error"):
-                fail += 1
-            else:
-                ok += 1
+    try:
+        async with aiofiles.open(output_file, "wb") as fh:
+            for _ in tqdm.tqdm(range(len(samples)), desc="Processing progress"):
+                res = await results.get()
+                await fh.write(dumps_jsonl(res))
+                if res.get("error"):
+                    fail += 1
+                else:
+                    ok += 1
+                if (ok + fail) % FLUSH_EVERY == 0:
+                    await fh.flush()
+        await asyncio.gather(*workers)
+    finally:
+        # Workers are still blocked on the queue if the writer failed
+        for w in workers:
+            w.cancel()
+        img_pool.shutdown()
 
     print(f"\nProcessing completed! Success: {ok}  Failed: {fail}")
     print(f"Results saved to: {output_file}")
 
 def main():
     import argparse
-    global MAX_CONC, MAX_RETRIES, OPENAI_KEY, API_BASE
+    global MAX_CONC, MAX_RETRIES, OPENAI_KEY, API_BASE, KEEP_RAW_RESPONSE
 
     parser = argparse.ArgumentParser(description="Multi-image reasoning based on qa.jsonl (single mode, client scales proportionally to fixed max_pixels, uniformly converts to JPEG)")
     parser.add_argument("--dataset", type=str, required=True, help="Dataset name (located at datasets/<dataset>)")
@@ -256,12 +320,14 @@ def main():
     parser.add_argument("--max-retries", type=int, default=MAX_RETRIES, help="Maximum retry attempts")
     parser.add_argument("--limit", type=int, default=None, help="Process only first N samples (for debugging)")
     parser.add_argument("--max-images", type=int, default=None, help="Maximum number of images to send (default: unlimited)")
+    parser.add_argument("--keep-raw-response", action="store_true", help="Also write the unparsed model response as raw_response")
     args = parser.parse_args()
 
     MAX_CONC = args.concurrency
     MAX_RETRIES = args.max_retries
     OPENAI_KEY = args.api_key
     API_BASE = args.api_base
+    KEEP_RAW_RESPONSE = args.keep_raw_response
 
     samples = load_qa_jsonl(args.dataset, args.jsonl, args.limit)
     if args.output is None:
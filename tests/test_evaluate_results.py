@@ -0,0 +1,40 @@
+import math
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import evaluate_results
+
+
+class LoadPredictionsTest(unittest.TestCase):
+    def _load(self, *lines: str) -> dict:
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False, encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        try:
+            return evaluate_results.load_predictions(f.name)
+        finally:
+            os.unlink(f.name)
+
+    def test_wide_integer_stays_exact(self):
+        predictions = self._load(
+            '{"dataset": "d", "url": "images/a.jpg", "model_result": {"id": 123456789012345678901234}}',
+            '{"dataset": "d", "url": "images/b.jpg", "model_result": {"id": -9223372036854775809}}',
+        )
+        self.assertEqual(predictions["d"]["a.jpg"]["id"], 123456789012345678901234)
+        self.assertIsInstance(predictions["d"]["a.jpg"]["id"], int)
+        self.assertEqual(predictions["d"]["b.jpg"]["id"], -9223372036854775809)
+
+    def test_nan_and_infinity_are_accepted(self):
+        predictions = self._load(
+            '{"dataset": "d", "url": "images/a.jpg", "model_result": {"score": NaN}}',
+            '{"dataset": "d", "url": "images/b.jpg", "model_result": {"score": Infinity}}',
+        )
+        self.assertTrue(math.isnan(predictions["d"]["a.jpg"]["score"]))
+        self.assertEqual(predictions["d"]["b.jpg"]["score"], math.inf)
+
+
+if __name__ == '__main__':
+    unittest.main()